@@ -0,0 +1,136 @@
+'''
+Relationship analytics on sorted arrays of user ids.
+Friend and follower ids are loaded once as NumPy int64 arrays and kept
+until the user's next sync, so set operations never go back to SQL.
+'''
+
+from collections import OrderedDict
+from functools import reduce
+
+import numpy as np
+
+from .constants import BaquetConstants
+from .helpers import get_watchlist
+
+# (user id, kind) to (sync version, ids), least recently used first.
+_ARRAYS = OrderedDict()
+_ARRAYS_SIZE = 256
+
+
+def to_ids(values):
+    '''
+    Turn user ids into a sorted, duplicate free int64 array.
+    '''
+    return np.unique(np.fromiter((int(value) for value in values), dtype=np.int64))
+
+
+def get_ids(user, kind):
+    '''
+    Get a user's friend or follower ids as a sorted int64 array.
+    The array is cached until the relationship is synced again.
+    '''
+    key = (user.get_user_id(), kind)
+    cached = _ARRAYS.get(key)
+
+    get_relationship_ids = {
+        BaquetConstants.FRIENDS: user.get_friends_ids,
+        BaquetConstants.FOLLOWERS: user.get_followers_ids,
+    }[kind]
+    version, ids = get_relationship_ids(version=cached[0] if cached else None)
+
+    if ids is None:
+        _ARRAYS.move_to_end(key)
+        return cached[1]
+
+    # Packed relationships come as sorted arrays already. A memory mapped one
+    # is copied, so that the cache does not keep its file mapped, which would
+    # stop the next sync from replacing it on Windows.
+    if isinstance(ids, np.memmap):
+        ids = np.array(ids)
+        ids.flags.writeable = False
+    elif not isinstance(ids, np.ndarray):
+        ids = to_ids(ids)
+        ids.flags.writeable = False
+    _ARRAYS[key] = (version, ids)
+    if len(_ARRAYS) > _ARRAYS_SIZE:
+        _ARRAYS.popitem(last=False)
+    return ids
+
+
+def get_watchlist_ids(watchlist):
+    '''
+    Get a Watchlist or list of user ids as a sorted int64 array.
+    '''
+    return to_ids(get_watchlist(watchlist, kind=BaquetConstants.WATCHLIST))
+
+
+def _contains(ids, values):
+    # For each of values, whether it is in ids. Both must be sorted.
+    if ids.size == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(ids, values)
+    positions[positions == len(ids)] = 0
+    return ids[positions] == values
+
+
+def intersect(ids, other):
+    '''
+    The ids in both sorted arrays.
+    '''
+    if len(ids) > len(other):
+        ids, other = other, ids
+    return ids[_contains(other, ids)]
+
+
+def difference(ids, other):
+    '''
+    The ids of the first sorted array that are not in the second.
+    '''
+    return ids[~_contains(other, ids)]
+
+
+def count_common(ids, other):
+    '''
+    The number of ids in both sorted arrays.
+    '''
+    if len(ids) > len(other):
+        ids, other = other, ids
+    return int(np.count_nonzero(_contains(other, ids)))
+
+
+def watchlist_overlap(user, watchlist, kind=BaquetConstants.FOLLOWERS):
+    '''
+    The friends or followers of a user that are on the watchlist.
+    '''
+    return intersect(get_ids(user, kind), get_watchlist_ids(watchlist))
+
+
+def mutuals(user):
+    '''
+    The users that this user follows and that follow them back.
+    '''
+    return intersect(
+        get_ids(user, BaquetConstants.FRIENDS),
+        get_ids(user, BaquetConstants.FOLLOWERS)
+    )
+
+
+def common(users, kind=BaquetConstants.FOLLOWERS):
+    '''
+    The friends or followers that all of the users have in common.
+    '''
+    return reduce(intersect, (get_ids(user, kind) for user in users))
+
+
+def compare(user, other, kind=BaquetConstants.FOLLOWERS):
+    '''
+    Split the friends or followers of two users into
+    (only the first user's, both, only the other's).
+    '''
+    ids = get_ids(user, kind)
+    other_ids = get_ids(other, kind)
+    return (
+        difference(ids, other_ids),
+        intersect(ids, other_ids),
+        difference(other_ids, ids),
+    )
@@ -12,9 +12,32 @@ class BaquetConstants():
     CACHE = "cache"
     WATCHLIST = "watchlist"
     WATCHWORDS = "watchwords"
+    SEARCH = "search"
     FAVORITE = "favorite"
+    FAVORITES = "favorites"
     TIMELINE = "timeline"
     RETWEET = "retweet"
+    FRIENDS = "friends"
+    FOLLOWERS = "followers"
+
+    # RELATIONSHIP STORAGE
+    STORAGE_TABLE = "table"
+    STORAGE_PACKED = "packed"
+    STORAGE_PACKED_COMPRESSED = "packed_compressed"
+
+    # STORAGE PROFILES
+    PROFILE_DURABLE = "durable"
+    PROFILE_FAST_INGEST = "fast-ingest"
+    PROFILE_READ_MOSTLY = "read-mostly"
+
+    # STREAMING
+    STREAM_BATCH_SIZE = 1000
+
+    # TWEET FETCHING
+    # Fetches of `limit` tweets made in one refresh to fill a gap in the timeline.
+    MAX_GAP_FETCHES = 10
+    # The most likes the favorites endpoint returns in one page.
+    FAVORITES_PAGE_SIZE = 200
 
     # SUBLIST TYPES
     SUBLIST_TYPE_SELF = 1
@@ -7,25 +7,23 @@ from datetime import datetime, timedelta
 from math import ceil
 from os import listdir
 from pathlib import Path
-import uuid
+from threading import Lock
 
 from sqlalchemy_pagination import paginate
-from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import create_engine, and_
 
 from .constants import BaquetConstants
+from .engines import ENGINES
+from .migrations import migrate
 from .sql.directory import (
-    BASE as DIR_BASE,
     DirectorySQL,
     CacheSQL,
-    TempJoinSQL as DirTempJoinSQL
 )
 from .helpers import (
-    make_api,
-    make_config,
+    get_api,
     transform_user,
-    serialize_entities,
-    serialize_paginated_entities
+    bulk_upsert,
+    id_set,
+    row_columns,
 )
 from .models import (
     load_model,
@@ -33,6 +31,10 @@ from .models import (
     UserModel,
 )
 
+# Opened by get_directory when first needed.
+_DIRECTORY = None
+_DIRECTORY_LOCK = Lock()
+
 
 def hydrate_user_identifiers(user_ids=None, screen_names=None):
     '''
@@ -51,9 +53,8 @@ def hydrate_user_identifiers(user_ids=None, screen_names=None):
     if not user_identifiers:
         return results
 
-    cache_results = _DIRECTORY.get_cache(
+    cache_results = get_directory().get_cache(
         user_ids=user_ids, screen_names=screen_names)
-    cache_results = [serialize_entities(user) for user in cache_results]
     cache_results_ids = [user.user_id for user in cache_results]
     cache_results_screen_names = [
         user.screen_name.lower() for user in cache_results
@@ -74,17 +75,19 @@ def hydrate_user_identifiers(user_ids=None, screen_names=None):
             end = len(user_identifiers) if (i + 1) * \
                 100 > len(user_identifiers) else (i + 1) * 100
             if user_ids:
-                users = _API.lookup_users(user_ids=user_identifiers[start:end])
+                users = get_api().lookup_users(user_ids=user_identifiers[start:end])
             else:
-                users = _API.lookup_users(
+                users = get_api().lookup_users(
                     screen_names=user_identifiers[start:end])
 
-            for user in users:
-                _DIRECTORY.add_cache(user)
+            get_directory().add_cache(users)
 
             tweepy_results.extend(users)
-        tweepy_results = [serialize_entities(transform_user(result, kind=BaquetConstants.USER))
-                          for result in tweepy_results]
+        tweepy_results = load_model(
+            [transform_user(result, kind=BaquetConstants.USER) for result in tweepy_results],
+            UserModel,
+            many=True
+        )
 
     results = cache_results + tweepy_results
 
@@ -103,19 +106,13 @@ class Directory:
 
     def _make_conn(self):
         database = self._path.joinpath(Path('./directory.db'))
-        engine = create_engine(
-            f'sqlite:///{database}', connect_args={"check_same_thread": False})
-        session_factory = sessionmaker(
-            autocommit=False, autoflush=False, bind=engine)
-
-        session = scoped_session(
-            session_factory
+        database.parent.mkdir(parents=True, exist_ok=True)
+        _, session = ENGINES.get(
+            database,
+            setup=lambda engine: migrate(engine, BaquetConstants.DIRECTORY),
+            owner=self
         )
 
-        if not database.exists():
-            database.parent.mkdir(parents=True, exist_ok=True)
-            DIR_BASE.metadata.create_all(engine)
-
         return session
 
     @contextmanager
@@ -131,23 +128,6 @@ class Directory:
 
     # DIRECTORY
 
-    def _add_temp_join(self, join_data):
-        join_id = uuid.uuid4().hex
-        join = [DirTempJoinSQL(join_id=join_id, join_on=j) for j in join_data]
-
-        with self._session() as session:
-            session.bulk_save_objects(join)
-            session.commit()
-
-        return join_id
-
-    def _remove_temp_join(self, join_id):
-        with self._session() as session:
-            session.query(DirTempJoinSQL).filter(
-                DirTempJoinSQL.join_id == join_id
-            ).delete(synchronize_session='fetch')
-            session.commit()
-
     def add_directory(self, user):
         '''
         Add or update a user in the directory.
@@ -157,22 +137,27 @@ class Directory:
             session.merge(user)
             session.commit()
 
-    def get_directory(self, page, page_size=20):
+    def get_directory(self, page, page_size=20, include_entities=True):
         '''
         Get users in the directory.
         '''
         with self._session() as session:
-            results = serialize_paginated_entities(
-                paginate(
-                    session.query(DirectorySQL).order_by(
-                        DirectorySQL.screen_name
-                    ),
-                    page=page,
-                    page_size=page_size
-                )
+            results = paginate(
+                session.query(*row_columns(DirectorySQL, include_entities)).order_by(
+                    DirectorySQL.screen_name
+                ),
+                page=page,
+                page_size=page_size
             )
             return load_model(results, UserPaginatorModel)
 
+    def get_user_ids(self):
+        '''
+        Get the ids of every user in the directory.
+        '''
+        with self._session() as session:
+            return [user_id for user_id, in session.query(DirectorySQL.user_id).all()]
+
     def scan_and_update_directory(self):
         '''
         Find the difference between the folder contents and the user directory
@@ -208,50 +193,47 @@ class Directory:
 
     # CACHE
 
-    def add_cache(self, user):
+    def add_cache(self, users):
         '''
-        Add a user to the cache.
+        Add one or more users to the cache.
         '''
+        if not isinstance(users, list):
+            users = [users]
+
         with self._session() as session:
-            session.merge(transform_user(user, kind=BaquetConstants.CACHE))
+            bulk_upsert(
+                session,
+                CacheSQL,
+                (transform_user(user, kind=BaquetConstants.CACHE) for user in users)
+            )
             session.commit()
 
-    def get_cache(self, user_ids, screen_names):
+    def get_cache(self, user_ids, screen_names, include_entities=True):
         '''
         Get users in the cache.
         '''
-
         if user_ids:
-            user_id_join = self._add_temp_join(user_ids)
-
-            with self._session() as session:
-                results = session.query(CacheSQL).join(
-                    DirTempJoinSQL,
-                    and_(
-                        CacheSQL.user_id == DirTempJoinSQL.join_on,
-                        DirTempJoinSQL.join_id == user_id_join
-                    )
-                ).all()
-
-            self._remove_temp_join(user_id_join)
+            ids = id_set(user_ids)
+            join_on = CacheSQL.user_id == ids.c.value
         else:
-            screen_name_join = self._add_temp_join(screen_names)
-
-            with self._session() as session:
-                results = session.query(CacheSQL).join(
-                    DirTempJoinSQL,
-                    and_(
-                        CacheSQL.screen_name == DirTempJoinSQL.join_on,
-                        DirTempJoinSQL.join_id == screen_name_join
-                    )
-                ).all()
+            ids = id_set(screen_names)
+            join_on = CacheSQL.screen_name == ids.c.value
 
-            self._remove_temp_join(screen_name_join)
+        with self._session() as session:
+            results = session.query(
+                *row_columns(CacheSQL, include_entities)
+            ).join(ids, join_on).all()
 
         return load_model(results, UserModel, many=True)
 
 
-# GLOBALS
-_CONFIG = make_config()
-_API = make_api(_CONFIG)
-_DIRECTORY = Directory()
+def get_directory():
+    '''
+    The shared Directory, opened on first use.
+    '''
+    global _DIRECTORY  # pylint: disable=global-statement
+    if _DIRECTORY is None:
+        with _DIRECTORY_LOCK:
+            if _DIRECTORY is None:
+                _DIRECTORY = Directory()
+    return _DIRECTORY
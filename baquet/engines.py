@@ -0,0 +1,191 @@
+'''
+One engine and session factory per database file, shared across the process.
+'''
+
+from collections import OrderedDict
+from threading import RLock
+from time import monotonic
+from weakref import finalize
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from .constants import BaquetConstants
+
+# The pragmas set on every new connection, by storage profile.
+# All use WAL, so that readers and the writer do not block each other.
+STORAGE_PROFILES = {
+    # Every commit is synced, for databases that are expensive to refetch.
+    BaquetConstants.PROFILE_DURABLE: {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -16384,
+    },
+    # Nothing is synced, a crash of the machine can lose recent commits.
+    BaquetConstants.PROFILE_FAST_INGEST: {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'temp_store': 'MEMORY',
+        'cache_size': -65536,
+        'wal_autocheckpoint': 10000,
+    },
+    # Synced at checkpoints only, with the database memory mapped for reads.
+    BaquetConstants.PROFILE_READ_MOSTLY: {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'temp_store': 'MEMORY',
+        'cache_size': -65536,
+        'mmap_size': 268435456,
+    },
+}
+
+
+def apply_storage_profile(engine, profile):
+    '''
+    Set a profile's pragmas on each new connection of the engine.
+    The profile is a name from STORAGE_PROFILES or a dict of pragmas,
+    None leaves the SQLite defaults.
+    '''
+    if isinstance(profile, str):
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f'Unknown storage profile: {profile}')
+        profile = STORAGE_PROFILES[profile]
+
+    if not profile:
+        return
+
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for name, value in profile.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    event.listen(engine, 'connect', set_pragmas)
+
+
+class EngineRegistry:
+    '''
+    Engines and their scoped sessions, keyed by database path.
+    An engine is held while any owner given to get is alive, and is never disposed then.
+    Beyond max_size, the least recently used engine nobody holds is disposed,
+    and so is any engine nobody has held for longer than idle_timeout seconds.
+    New engines use the storage profile, see apply_storage_profile.
+    '''
+
+    def __init__(self, max_size=128, idle_timeout=600, profile=BaquetConstants.PROFILE_DURABLE):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.profile = profile
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def get(self, database, setup=None, connect_args=None, owner=None):
+        '''
+        Get (engine, scoped session) for a database file, creating them on first use.
+        setup is called once with a new engine, to add listeners or migrate.
+        The engine is held until owner is garbage collected.
+        Every caller of a database must give the same connect_args.
+        '''
+        key = str(database.resolve())
+        connect_args = {"check_same_thread": False, **(connect_args or {})}
+
+        with self._lock:
+            self._evict_idle()
+
+            entry = self._entries.get(key)
+            if entry:
+                if entry.connect_args != connect_args:
+                    raise ValueError(
+                        f'{database} is open with connect_args {entry.connect_args}, '
+                        f'not {connect_args}'
+                    )
+                self.hits += 1
+                self._entries.move_to_end(key)
+            else:
+                self.misses += 1
+                engine = create_engine(f'sqlite:///{database}', connect_args=connect_args)
+                session = scoped_session(
+                    sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                )
+                apply_storage_profile(engine, self.profile)
+                if setup:
+                    setup(engine)
+
+                entry = _Entry(engine, session, connect_args)
+                self._entries[key] = entry
+
+            entry.last_used = monotonic()
+            if owner is not None:
+                entry.holders += 1
+                finalize(owner, self._release, entry)
+
+            self._evict_over_size()
+            return entry.engine, entry.session
+
+    def _release(self, entry):
+        with self._lock:
+            entry.holders -= 1
+            entry.last_used = monotonic()
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        entry.session.remove()
+        entry.engine.dispose()
+        self.evictions += 1
+
+    def _evict_idle(self):
+        expired = monotonic() - self.idle_timeout
+        for key in [
+                key for key, entry in self._entries.items()
+                if not entry.holders and entry.last_used < expired
+        ]:
+            self._evict(key)
+
+    def _evict_over_size(self):
+        # Held engines stay, so the registry can grow past max_size while they are held.
+        unheld = [key for key, entry in self._entries.items() if not entry.holders]
+        for key in unheld[:max(0, len(self._entries) - self.max_size)]:
+            self._evict(key)
+
+    def clear(self):
+        '''
+        Dispose of every engine, held or not.
+        '''
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+    def stats(self):
+        '''
+        Get the hit, miss and eviction counters and the number of open and held engines.
+        '''
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'held': sum(1 for entry in self._entries.values() if entry.holders),
+            }
+
+
+class _Entry:
+    '''
+    A registry entry: the engine, its sessions and who is using it.
+    '''
+
+    __slots__ = ('engine', 'session', 'connect_args', 'last_used', 'holders')
+
+    def __init__(self, engine, session, connect_args):
+        self.engine = engine
+        self.session = session
+        self.connect_args = connect_args
+        self.last_used = monotonic()
+        self.holders = 0
+
+
+# The registry used by User, Watchlist, Directory and GlobalSearch.
+ENGINES = EngineRegistry()
@@ -2,15 +2,23 @@
 A place to put code common to user and watchlist.
 '''
 
+import base64
 import json
 import re
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-from copy import copy
+from functools import lru_cache
+from threading import Lock
 
 import tweepy
+from sqlalchemy import and_, or_, desc, false, text, DateTime
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from .constants import BaquetConstants
+from .models import load_model
 from .sql.user import (
     UsersSQL,
     TimelineSQL,
@@ -24,6 +32,13 @@ from .sql.watchlist import (
     WatchlistSQL
 )
 
+# Messages SQLite gives for a full-text query it cannot parse.
+_FTS_QUERY_ERRORS = ('fts5: syntax error', 'unterminated string', 'unknown special query', 'no such column')
+
+# Made by get_api when first needed, so that importing baquet needs no config.
+_API = None
+_API_LOCK = Lock()
+
 
 def make_config():
     '''
@@ -56,17 +71,161 @@ def make_api(config):
     return api
 
 
+def get_api():
+    '''
+    The shared Tweepy api object, made from the config on first use.
+    '''
+    global _API  # pylint: disable=global-statement
+    if _API is None:
+        with _API_LOCK:
+            if _API is None:
+                _API = make_api(make_config())
+    return _API
+
+
+_REGEX_SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+
+class WatchwordMatcher:
+    '''
+    Matches text against a set of watchwords, compiled once.
+    Watchwords without regex syntax are merged into a single alternation
+    that is checked first; the rest are tried one by one.
+    '''
+
+    def __init__(self, watchwords):
+        self.watchwords = tuple(sorted(set(watchwords)))
+        self._literals = [
+            watchword for watchword in self.watchwords
+            if not _REGEX_SPECIAL_CHARACTERS.intersection(watchword)
+        ]
+        self._regexes = [
+            (watchword, re.compile(watchword)) for watchword in self.watchwords
+            if _REGEX_SPECIAL_CHARACTERS.intersection(watchword)
+        ]
+        self._literal_regex = re.compile(
+            '|'.join(
+                re.escape(literal)
+                for literal in sorted(self._literals, key=len, reverse=True)
+            )
+        ) if self._literals else None
+        self.pattern = self._combined_pattern()
+
+    def _combined_pattern(self):
+        '''
+        One regex equivalent to all watchwords, for matching in SQL.
+        None when a watchword uses groups or inline flags,
+        which would change meaning once combined.
+        '''
+        if not self.watchwords:
+            return None
+        if any(regex.groups or watchword.startswith('(?') for watchword, regex in self._regexes):
+            return None
+
+        alternatives = [regex.pattern for regex in (
+            [self._literal_regex] if self._literal_regex else []
+        )] + [f'(?:{watchword})' for watchword, _ in self._regexes]
+        return '|'.join(alternatives)
+
+    def search(self, text):
+        '''
+        Whether the text matches any watchword.
+        '''
+        if not text:
+            return False
+        if self._literal_regex and self._literal_regex.search(text):
+            return True
+        return any(regex.search(text) for _, regex in self._regexes)
+
+    def matches(self, text):
+        '''
+        The watchwords that the text matches.
+        '''
+        if not text:
+            return []
+
+        matched = []
+        if self._literal_regex and self._literal_regex.search(text):
+            matched.extend(
+                literal for literal in self._literals if literal in text)
+        matched.extend(
+            watchword for watchword, regex in self._regexes if regex.search(text))
+        return matched
+
+    @classmethod
+    def from_watchlist(cls, watchlist):
+        '''
+        Get the matcher for a Watchlist's watchwords.
+        '''
+        return get_watchword_matcher(watchlist)
+
+
+@lru_cache(maxsize=128)
+def _cached_watchword_matcher(watchwords):
+    return WatchwordMatcher(watchwords)
+
+
+def get_watchword_matcher(watchwords):
+    '''
+    Get a matcher for a Watchlist or a list of watchwords.
+    Matchers are cached, so the same set of watchwords is only compiled once.
+    '''
+    if isinstance(watchwords, WatchwordMatcher):
+        return watchwords
+
+    return _cached_watchword_matcher(
+        frozenset(get_watchlist(watchwords, kind=BaquetConstants.WATCHWORDS))
+    )
+
+
 def filter_for_watchwords(results, watchwords):
     '''
     Filter a set of results that contain one or more search terms.
     '''
-    matches = []
+    matcher = get_watchword_matcher(watchwords)
+    return [result for result in results if matcher.search(result.text)]
+
+
+def set_matched_watchwords(results, watchwords):
+    '''
+    Record on each result which watchwords its text matches.
+    '''
+    matcher = get_watchword_matcher(watchwords)
     for result in results:
-        for regex in watchwords:
-            if re.search(regex, result.text):
-                matches.append(result)
-                break
-    return matches
+        result.matched_watchwords = matcher.matches(result.text)
+    return results
+
+
+@lru_cache(maxsize=1024)
+def _compile_watchword(regex):
+    return re.compile(regex)
+
+
+def _regexp(regex, text):
+    return text is not None and _compile_watchword(regex).search(text) is not None
+
+
+def register_regexp(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+    '''
+    Connect event listener that gives SQLite a REGEXP function,
+    so that watchwords can be matched inside queries.
+    '''
+    dbapi_connection.create_function('REGEXP', 2, _regexp, deterministic=True)
+
+
+def filter_by_watchwords(column, watchwords):
+    '''
+    A SQL condition that is true when the column matches any of the watchwords.
+    Needs REGEXP on the connection, see register_regexp.
+    '''
+    matcher = get_watchword_matcher(watchwords)
+    if matcher.pattern:
+        return column.op('REGEXP')(matcher.pattern)
+
+    return or_(
+        false(),
+        *[column.op('REGEXP')(regex) for regex in matcher.watchwords]
+    )
 
 
 def get_watchlist(watchlist, kind):
@@ -82,6 +241,17 @@ def get_watchlist(watchlist, kind):
     return watchlist
 
 
+def id_set(ids):
+    '''
+    A table of ids bound as one JSON parameter through SQLite's json_each,
+    to join against without writing the ids to the database.
+    Join on its `c.value` column.
+    '''
+    return func.json_each(
+        json.dumps(sorted({str(i) for i in ids}))
+    ).table_valued('value')
+
+
 def _transform_user_id(user):
     user_id = None
 
@@ -214,23 +384,180 @@ def transform_tweet(tweet, kind):
     )
 
 
-def serialize_entities(item):
+def model_to_row(item):
+    '''
+    Get the column values of a SQLAlchemy model instance as a dict.
+    '''
+    return {
+        column.name: getattr(item, column.name)
+        for column in item.__table__.columns
+    }
+
+
+def _upsert_statement(table):
+    primary_key = [column.name for column in table.primary_key.columns]
+    statement = sqlite_insert(table)
+    update = {
+        column.name: statement.excluded[column.name]
+        for column in table.columns if column.name not in primary_key
+    }
+    if update:
+        return statement.on_conflict_do_update(
+            index_elements=primary_key,
+            set_=update
+        )
+    return statement.on_conflict_do_nothing(index_elements=primary_key)
+
+
+def bulk_upsert(session, model, rows, batch_size=1000):
+    '''
+    Insert or update many rows of a model with INSERT ... ON CONFLICT DO UPDATE,
+    sent in batches. Rows may be model instances or dicts.
+    Nothing is committed, so the caller controls the transaction.
+    '''
+    statement = _upsert_statement(model.__table__)
+
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row if isinstance(row, dict) else model_to_row(row))
+        if len(batch) == batch_size:
+            session.execute(statement, batch)
+            count += len(batch)
+            batch = []
+
+    if batch:
+        session.execute(statement, batch)
+        count += len(batch)
+
+    return count
+
+
+class KeysetPage:
+    '''
+    One page of keyset paginated results.
+    '''
+
+    def __init__(self, items, next_cursor, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+        self.total = total
+
+
+def encode_cursor(values):
+    '''
+    Turn the sort key of the last row on a page into an opaque cursor.
+    '''
+    values = [
+        value.isoformat() if isinstance(value, datetime) else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    '''
+    Turn a cursor back into the sort key values for the given columns.
+    '''
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return [
+        datetime.fromisoformat(value)
+        if isinstance(column.type, DateTime) and value is not None else value
+        for column, value in zip(columns, values)
+    ]
+
+
+def _keyset_after(columns, values, descending):
+    column, value = columns[0], values[0]
+    after = column < value if descending else column > value
+
+    if len(columns) == 1:
+        return after
+
+    return or_(
+        after,
+        and_(
+            column == value,
+            _keyset_after(columns[1:], values[1:], descending)
+        )
+    )
+
+
+def keyset_paginate(query, columns, cursor=None, page_size=20, descending=False, total=None):
     '''
-    When going from SQLAlchemy to JSON, serialize the entities.
+    Page through a query ordered by the given columns,
+    starting after the row the cursor points at.
+    The last column must be unique so that no rows are skipped.
+    Unlike paginate, no OFFSET is used and nothing is counted.
     '''
-    # Without copying, there's some SQLAlchemy weirdness.
-    item = copy(item)
-    if hasattr(item, BaquetConstants.ATTR_ENTITIES) and item.entities:
-        item.entities = json.loads(item.entities)
-    return item
+    if cursor:
+        query = query.filter(
+            _keyset_after(columns, decode_cursor(cursor, columns), descending)
+        )
+
+    items = query.order_by(
+        *[desc(column) if descending else column for column in columns]
+    ).limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(
+            [getattr(items[-1], column.key) for column in columns]
+        )
+
+    return KeysetPage(items, next_cursor, total)
+
+
+def stream_models(session, query, model_class, batch_size, watchwords=None):
+    '''
+    Yield the rows of a query as models, fetched batch_size at a time
+    from a single cursor, so memory stays bounded however many rows there are.
+    '''
+    result = session.execute(query.statement.execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        models = load_model(rows, model_class, many=True)
+        if watchwords:
+            set_matched_watchwords(models, watchwords)
+        yield from models
+
+
+def row_columns(model, include_entities=True):
+    '''
+    The columns to select to read a model as plain rows instead of ORM objects.
+    Leave out entities when the caller has no use for them.
+    '''
+    return [
+        column for column in model.__table__.columns
+        if include_entities or column.key != BaquetConstants.ATTR_ENTITIES
+    ]
+
+
+def require_search_index(session, name):
+    '''
+    Raise RuntimeError unless the database has the FTS5 index, which is not
+    created when SQLite was built without FTS5.
+    '''
+    found = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': name}
+    ).first()
+    if not found:
+        raise RuntimeError(
+            f'Full-text search needs SQLite with FTS5, {name} does not exist, '
+            'see User.rebuild_search_index'
+        )
 
 
-def serialize_paginated_entities(page):
+@contextmanager
+def search_query_errors(query):
     '''
-    For each page in the sqlalchemy paginator, serialize the entities.
+    Raise ValueError instead of OperationalError for a malformed full-text query.
     '''
-    new_items = []
-    for item in page.items:
-        new_items.append(serialize_entities(item))
-    page.items = new_items
-    return page
+    try:
+        yield
+    except OperationalError as error:
+        if not str(error.orig).startswith(_FTS_QUERY_ERRORS):
+            raise
+        raise ValueError(f'Invalid search query {query!r}: {error.orig}') from error
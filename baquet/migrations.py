@@ -0,0 +1,216 @@
+'''
+Versioned schema upgrades for user, directory and watchlist databases.
+The version of each database is kept in SQLite's user_version pragma.
+'''
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import OperationalError
+
+from .constants import BaquetConstants
+from .sql.frozen import USER_V1, USER_V4, DIRECTORY_V1, WATCHLIST_V1, SEARCH_V1
+
+
+def _create_missing(connection, metadata):
+    '''
+    Create the tables, columns and indexes of the metadata that do not exist yet.
+    Safe to run repeatedly. Steps pass the frozen tables of sql.frozen,
+    never the live models, so that a released step always does the same thing.
+    '''
+    metadata.create_all(connection)
+
+    inspector = inspect(connection)
+    for table in metadata.sorted_tables:
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                    f'{column.type.compile(connection.dialect)}'
+                )
+
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _user_v1(connection):
+    # Sync state, relationship staging and changes, secondary indexes.
+    _create_missing(connection, USER_V1)
+
+
+def _create_search_index(connection, table):
+    '''
+    Mirror a table's text column into an FTS5 index kept in sync by triggers.
+    '''
+    fts = f'{table}_fts'
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} "
+        f"USING fts5(text, content='{table}', content_rowid='rowid')"
+    )
+    connection.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, text) VALUES (new.rowid, new.text); END"
+    )
+    connection.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.rowid, old.text); END"
+    )
+    connection.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF text ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.rowid, old.text); "
+        f"INSERT INTO {fts}(rowid, text) VALUES (new.rowid, new.text); END"
+    )
+    connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _has_fts5(connection):
+    '''
+    Whether SQLite can make FTS5 tables, built in or loaded as an extension.
+    '''
+    try:
+        connection.exec_driver_sql('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(text)')
+    except OperationalError as error:
+        if 'no such module: fts5' in str(error.orig):
+            return False
+        raise
+    connection.exec_driver_sql('DROP TABLE temp.fts5_probe')
+    return True
+
+
+def _user_v2(connection):
+    # Full-text search of timeline and favorites, when SQLite has FTS5.
+    if _has_fts5(connection):
+        for table in (BaquetConstants.TIMELINE, BaquetConstants.FAVORITES):
+            _create_search_index(connection, table)
+
+
+def _drop_temp_joins(connection):
+    # Id sets are bound as query parameters now, see helpers.id_set.
+    connection.exec_driver_sql('DROP TABLE IF EXISTS temp_joins')
+
+
+def _user_v3(connection):
+    _drop_temp_joins(connection)
+
+
+def _user_v4(connection):
+    # Relationship sketches.
+    _create_missing(connection, USER_V4)
+
+
+def _directory_v1(connection):
+    # Secondary indexes.
+    _create_missing(connection, DIRECTORY_V1)
+
+
+def _directory_v2(connection):
+    _drop_temp_joins(connection)
+
+
+def _watchlist_v1(connection):
+    _create_missing(connection, WATCHLIST_V1)
+
+
+def _search_v1(connection):
+    _create_missing(connection, SEARCH_V1)
+    connection.exec_driver_sql(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(text)'
+    )
+
+
+# Append new steps, never edit or reorder released ones.
+MIGRATIONS = {
+    BaquetConstants.USER: [_user_v1, _user_v2, _user_v3, _user_v4],
+    BaquetConstants.DIRECTORY: [_directory_v1, _directory_v2],
+    BaquetConstants.WATCHLIST: [_watchlist_v1],
+    BaquetConstants.SEARCH: [_search_v1],
+}
+
+
+def migrate(engine, kind):
+    '''
+    Run every migration step the database has not had yet.
+    Returns the resulting schema version.
+    '''
+    with engine.begin() as connection:
+        version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+        steps = MIGRATIONS[kind]
+        for number, step in enumerate(steps[version:], start=version + 1):
+            step(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {number}')
+
+    return max(version, len(steps))
+
+
+def rebuild_search_index(engine):
+    '''
+    Create whatever is missing of a user database's timeline and favorites
+    search indexes, as when it was migrated by a SQLite without FTS5,
+    and rebuild them from their tables.
+    '''
+    with engine.begin() as connection:
+        if not _has_fts5(connection):
+            raise RuntimeError('Full-text search needs SQLite with FTS5')
+        for table in (BaquetConstants.TIMELINE, BaquetConstants.FAVORITES):
+            _create_search_index(connection, table)
+
+
+def migrate_file(database, kind):
+    '''
+    Migrate a single database file.
+    '''
+    engine = create_engine(f'sqlite:///{database}')
+    try:
+        return migrate(engine, kind)
+    finally:
+        engine.dispose()
+
+
+def find_databases(users_path='./users/', watchlists_path='./watchlists/'):
+    '''
+    List every known database file along with its kind.
+    '''
+    databases = []
+
+    users_path = Path(users_path)
+    if users_path.exists():
+        for database in users_path.glob('*.db'):
+            if database.stem.isnumeric():
+                databases.append((database, BaquetConstants.USER))
+
+        directory = users_path.joinpath('directory.db')
+        if directory.exists():
+            databases.append((directory, BaquetConstants.DIRECTORY))
+
+        search = users_path.joinpath('search.db')
+        if search.exists():
+            databases.append((search, BaquetConstants.SEARCH))
+
+    watchlists_path = Path(watchlists_path)
+    if watchlists_path.exists():
+        for database in watchlists_path.glob('*.db'):
+            databases.append((database, BaquetConstants.WATCHLIST))
+
+    return databases
+
+
+def migrate_all(users_path='./users/', watchlists_path='./watchlists/', processes=None):
+    '''
+    Migrate every database in parallel, one file per worker at a time.
+    Yields (path, version) as each database finishes.
+    '''
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {
+            executor.submit(migrate_file, database, kind): database
+            for database, kind in find_databases(users_path, watchlists_path)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+if __name__ == '__main__':
+    for path, schema_version in migrate_all():
+        print(f'{path}: version {schema_version}')
@@ -1,20 +1,116 @@
 '''
 Output models to which we convert, so that SQLAlchemy models are not exposed.
+Models declare their attributes in __slots__, which load_model reads them by.
 '''
 
+import json
+from functools import lru_cache
+from inspect import Parameter, signature
+
+from sqlalchemy.engine import Row
+
+
+class LazyJSON:
+    '''
+    An attribute stored as its JSON string and decoded on first access,
+    in the slot of the same name with a leading underscore.
+    '''
+
+    def __set_name__(self, owner, name):
+        self._slot = getattr(owner, f"_{name}")
+
+    def __get__(self, model, owner=None):
+        if model is None:
+            return self
+        value = self._slot.__get__(model, owner)
+        if isinstance(value, str) and value:
+            value = json.loads(value)
+            self._slot.__set__(model, value)
+        return value
+
+    def __set__(self, model, value):
+        self._slot.__set__(model, value)
+
+
+def _public_name(model_class, slot):
+    # Slots behind a LazyJSON are read and written through its name instead.
+    if slot.startswith("_") and isinstance(model_class.__dict__.get(slot[1:]), LazyJSON):
+        return slot[1:]
+    return slot
+
+
+@lru_cache(maxsize=None)
+def model_fields(model_class):
+    '''
+    The attribute names of a model, including those of its bases.
+    '''
+    return tuple(
+        _public_name(base, field)
+        for base in reversed(model_class.__mro__)
+        for field in getattr(base, "__slots__", ())
+    )
+
+
+@lru_cache(maxsize=None)
+def _is_flat(model_class):
+    # Models whose __init__ only copies **kwargs can be filled without calling it.
+    parameters = list(signature(model_class.__init__).parameters.values())[1:]
+    return [parameter.kind for parameter in parameters] == [Parameter.VAR_KEYWORD]
+
+
+def _from_rows(rows, model_class, fields):
+    # Rows of one query share their keys, so look each field's position up once.
+    keys = rows[0]._fields
+    positions = [(field, keys.index(field)) for field in fields if field in keys]
+    missing = [field for field in fields if field not in keys]
+
+    models = []
+    for row in rows:
+        model = object.__new__(model_class)
+        for field, position in positions:
+            setattr(model, field, row[position])
+        for field in missing:
+            setattr(model, field, None)
+        models.append(model)
+    return models
+
+
+def _attributes(data, fields):
+    # Rows from column queries are mappings of their fields already.
+    if isinstance(data, Row):
+        return data._mapping  # pylint: disable=protected-access
+    return {field: getattr(data, field, None) for field in fields}
+
 
 def load_model(data, model_class, many=False):
     '''
     Any object goes in, object specified comes out.
+    Rows from column queries are converted straight from their tuples.
     '''
-    return (
-        [model_class(
-            **{attr: getattr(child, attr) for attr in dir(child) if "__" not in attr}
-        ) for child in data]
-        if many else
-        model_class(**{attr: getattr(data, attr)
-                       for attr in dir(data) if "__" not in attr})
-    )
+    fields = model_fields(model_class)
+    children = list(data) if many else [data]
+
+    if children and isinstance(children[0], Row) and _is_flat(model_class):
+        models = _from_rows(children, model_class, fields)
+    else:
+        models = [model_class(**_attributes(child, fields)) for child in children]
+
+    return models if many else models[0]
+
+
+def dump_model(model):
+    '''
+    A model as a dict, with nested models dumped too.
+    Models have no __dict__, so use this where vars(model) was used.
+    '''
+    if isinstance(model, list):
+        return [dump_model(item) for item in model]
+    if type(model).__module__ == __name__:
+        return {
+            field: dump_model(getattr(model, field))
+            for field in model_fields(type(model))
+        }
+    return model
 
 
 class UserModel:
@@ -22,6 +118,39 @@ class UserModel:
     Model representation of a User.
     '''
 
+    __slots__ = (
+        "contributors_enabled",
+        "created_at",
+        "default_profile",
+        "default_profile_image",
+        "description",
+        "_entities",
+        "favorites_count",
+        "followers_count",
+        "friends_count",
+        "geo_enabled",
+        "has_extended_profile",
+        "user_id",
+        "is_translation_enabled",
+        "is_translator",
+        "lang",
+        "listed_count",
+        "location",
+        "name",
+        "needs_phone_verification",
+        "profile_banner_url",
+        "profile_image_url",
+        "protected",
+        "screen_name",
+        "statuses_count",
+        "suspended",
+        "url",
+        "verified",
+        "last_updated",
+    )
+
+    entities = LazyJSON()
+
     def __init__(
             self,
             **kwargs,
@@ -61,6 +190,12 @@ class ListMembershipsModel:
     Model representation of a Twitter list membership.
     '''
 
+    __slots__ = (
+        "list_id",
+        "name",
+        "last_updated",
+    )
+
     def __init__(
             self,
             **kwargs,
@@ -75,6 +210,15 @@ class BasePaginatorModel:
     The base representation of a paginator.
     '''
 
+    __slots__ = (
+        "has_next",
+        "has_previous",
+        "next_page",
+        "pages",
+        "previous_page",
+        "total",
+    )
+
     def __init__(
             self,
             **kwargs,
@@ -87,11 +231,33 @@ class BasePaginatorModel:
         self.total = kwargs.get("total")
 
 
+class BaseCursorPaginatorModel:
+    '''
+    The base representation of a keyset paginator.
+    '''
+
+    __slots__ = (
+        "has_next",
+        "next_cursor",
+        "total",
+    )
+
+    def __init__(
+            self,
+            **kwargs,
+    ):
+        self.has_next = kwargs.get("has_next")
+        self.next_cursor = kwargs.get("next_cursor")
+        self.total = kwargs.get("total")
+
+
 class UserPaginatorModel(BasePaginatorModel):
     '''
     User Paginator.
     '''
 
+    __slots__ = ("items",)
+
     def __init__(
             self,
             items,
@@ -106,6 +272,13 @@ class NoteModel:
     Note representation.
     '''
 
+    __slots__ = (
+        "tweet_id",
+        "note_id",
+        "text",
+        "created_at",
+    )
+
     def __init__(
             self,
             **kwargs,
@@ -121,6 +294,8 @@ class NotePaginatorModel(BasePaginatorModel):
     Note paginator.
     '''
 
+    __slots__ = ("items",)
+
     def __init__(
             self,
             items,
@@ -135,6 +310,11 @@ class TagModel:
     Tag model.
     '''
 
+    __slots__ = (
+        "tag_id",
+        "text",
+    )
+
     def __init__(
             self,
             **kwargs,
@@ -148,6 +328,30 @@ class TweetModel:
     Tweet model.
     '''
 
+    __slots__ = (
+        "created_at",
+        "_entities",
+        "favorite_count",
+        "tweet_id",
+        "is_quote_status",
+        "lang",
+        "possibly_sensitive",
+        "retweet_count",
+        "source",
+        "source_url",
+        "text",
+        "retweet_user_id",
+        "retweet_screen_name",
+        "retweet_name",
+        "user_id",
+        "screen_name",
+        "name",
+        "last_updated",
+        "matched_watchwords",
+    )
+
+    entities = LazyJSON()
+
     def __init__(
             self,
             **kwargs,
@@ -170,6 +374,7 @@ class TweetModel:
         self.screen_name = kwargs.get("screen_name")
         self.name = kwargs.get("name")
         self.last_updated = kwargs.get("last_updated")
+        self.matched_watchwords = kwargs.get("matched_watchwords")
 
 
 class TweetPaginatorModel(BasePaginatorModel):
@@ -177,6 +382,24 @@ class TweetPaginatorModel(BasePaginatorModel):
     Tweet paginator model.
     '''
 
+    __slots__ = ("items",)
+
+    def __init__(
+            self,
+            items,
+            **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.items = load_model(items, TweetModel, many=True)
+
+
+class TweetCursorPaginatorModel(BaseCursorPaginatorModel):
+    '''
+    Tweet keyset paginator model.
+    '''
+
+    __slots__ = ("items",)
+
     def __init__(
             self,
             items,
@@ -191,6 +414,12 @@ class BaseRelationshipModel:
     Either following or follower, base.
     '''
 
+    __slots__ = (
+        "user",
+        "user_id",
+        "last_updated",
+    )
+
     def __init__(
             self,
             user=None,
@@ -206,6 +435,24 @@ class RelationshipPaginatorModel(BasePaginatorModel):
     Relationship paginator.
     '''
 
+    __slots__ = ("items",)
+
+    def __init__(
+            self,
+            items,
+            **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.items = load_model(items, BaseRelationshipModel, many=True)
+
+
+class RelationshipCursorPaginatorModel(BaseCursorPaginatorModel):
+    '''
+    Relationship keyset paginator.
+    '''
+
+    __slots__ = ("items",)
+
     def __init__(
             self,
             items,
@@ -220,6 +467,11 @@ class SublistTypeModel:
     Sublist type model.
     '''
 
+    __slots__ = (
+        "sublist_type_id",
+        "name",
+    )
+
     def __init__(
             self,
             **kwargs,
@@ -233,6 +485,13 @@ class SublistModel:
     Sublist model.
     '''
 
+    __slots__ = (
+        "sublist_id",
+        "sublist_type",
+        "name",
+        "external_id",
+    )
+
     def __init__(
             self,
             sublist_type,
@@ -242,3 +501,137 @@ class SublistModel:
         self.sublist_type = load_model(sublist_type, SublistTypeModel)
         self.name = kwargs.get("name")
         self.external_id = kwargs.get("external_id")
+
+
+class SearchResultModel:
+    '''
+    A tweet or like found by the global search.
+    '''
+
+    __slots__ = (
+        "owner_id",
+        "kind",
+        "tweet_id",
+        "text",
+    )
+
+    def __init__(
+            self,
+            **kwargs,
+    ):
+        self.owner_id = kwargs.get("owner_id")
+        self.kind = kwargs.get("kind")
+        self.tweet_id = kwargs.get("tweet_id")
+        self.text = kwargs.get("text")
+
+
+class SearchResultPaginatorModel(BasePaginatorModel):
+    '''
+    Global search paginator.
+    '''
+
+    __slots__ = ("items",)
+
+    def __init__(
+            self,
+            items,
+            **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.items = load_model(items, SearchResultModel, many=True)
+
+
+class SearchUserModel:
+    '''
+    A user with tweets or likes found by the global search.
+    '''
+
+    __slots__ = (
+        "owner_id",
+        "matches",
+    )
+
+    def __init__(
+            self,
+            **kwargs,
+    ):
+        self.owner_id = kwargs.get("owner_id")
+        self.matches = kwargs.get("matches")
+
+
+class WatchlistReportModel:
+    '''
+    How a user's timeline, likes and relationships overlap a watchlist,
+    with the counts behind each ratio.
+    '''
+
+    __slots__ = (
+        "user_id",
+        "watchlist_size",
+        "retweets",
+        "retweets_on_watchlist",
+        "retweet_watchlist_percent",
+        "favorites",
+        "favorites_on_watchlist",
+        "favorite_watchlist_percent",
+        "friends",
+        "friends_on_watchlist",
+        "friends_watchlist_percent",
+        "friends_watchlist_completion",
+        "followers",
+        "followers_on_watchlist",
+        "followers_watchlist_percent",
+        "followers_watchlist_completion",
+    )
+
+    def __init__(
+            self,
+            **kwargs,
+    ):
+        self.user_id = kwargs.get("user_id")
+        self.watchlist_size = kwargs.get("watchlist_size")
+        self.retweets = kwargs.get("retweets")
+        self.retweets_on_watchlist = kwargs.get("retweets_on_watchlist")
+        self.retweet_watchlist_percent = kwargs.get("retweet_watchlist_percent")
+        self.favorites = kwargs.get("favorites")
+        self.favorites_on_watchlist = kwargs.get("favorites_on_watchlist")
+        self.favorite_watchlist_percent = kwargs.get("favorite_watchlist_percent")
+        self.friends = kwargs.get("friends")
+        self.friends_on_watchlist = kwargs.get("friends_on_watchlist")
+        self.friends_watchlist_percent = kwargs.get("friends_watchlist_percent")
+        self.friends_watchlist_completion = kwargs.get("friends_watchlist_completion")
+        self.followers = kwargs.get("followers")
+        self.followers_on_watchlist = kwargs.get("followers_on_watchlist")
+        self.followers_watchlist_percent = kwargs.get("followers_watchlist_percent")
+        self.followers_watchlist_completion = kwargs.get("followers_watchlist_completion")
+
+
+class WatchlistEstimateModel:
+    '''
+    A watchlist percent, estimated from a sample when the full set is not fetched yet.
+    lower and upper are a heuristic Wilson interval, the sample being the first pages
+    rather than a random draw; exact is set only once the full set is fetched.
+    population is the user's followers count, which may be stale.
+    '''
+
+    __slots__ = (
+        "percent",
+        "lower",
+        "upper",
+        "confidence",
+        "sample_size",
+        "population",
+        "exact",
+    )
+
+    def __init__(
+            self,
+            **kwargs,
+    ):
+        self.percent = kwargs.get("percent")
+        self.lower = kwargs.get("lower")
+        self.upper = kwargs.get("upper")
+        self.confidence = kwargs.get("confidence")
+        self.sample_size = kwargs.get("sample_size")
+        self.population = kwargs.get("population")
+        self.exact = kwargs.get("exact")
@@ -0,0 +1,88 @@
+'''
+Packed snapshots of friend and follower ids, kept in files next to the user database.
+A snapshot is a sorted int64 array, stored either raw, so that it can be
+memory mapped without copying, or delta encoded and compressed with zlib.
+'''
+
+import os
+import zlib
+
+import numpy as np
+
+_DTYPE = np.dtype('<i8')
+RAW_SUFFIX = '.ids'
+COMPRESSED_SUFFIX = '.idz'
+TEMPORARY_SUFFIX = '.tmp'
+
+
+def packed_paths(database, resource):
+    '''
+    The raw and compressed snapshot paths of a resource of a user database.
+    '''
+    return (
+        database.with_name(f'{database.stem}.{resource}{RAW_SUFFIX}'),
+        database.with_name(f'{database.stem}.{resource}{COMPRESSED_SUFFIX}'),
+    )
+
+
+def find_packed(database, resource):
+    '''
+    The path of the resource's snapshot, or None if it is kept in its table.
+    '''
+    for path in packed_paths(database, resource):
+        if path.exists():
+            return path
+    return None
+
+
+def stage_packed(database, resource, ids, compress=False):
+    '''
+    Write the sorted ids to a temporary file beside the resource's snapshot,
+    for swap_packed to put in place once the database has committed.
+    '''
+    raw, compressed = packed_paths(database, resource)
+    ids = np.asarray(ids, dtype=_DTYPE)
+
+    if compress:
+        path = compressed
+        data = zlib.compress(np.diff(ids, prepend=0).astype(_DTYPE).tobytes())
+    else:
+        path = raw
+        data = ids.tobytes()
+
+    temporary = path.with_name(f'{path.name}{TEMPORARY_SUFFIX}')
+    temporary.write_bytes(data)
+    return temporary
+
+
+def swap_packed(temporary):
+    '''
+    Replace the resource's snapshot with one written by stage_packed,
+    removing the snapshot in the other encoding.
+    '''
+    path = temporary.with_suffix('')
+    stale = path.with_suffix(RAW_SUFFIX if path.suffix == COMPRESSED_SUFFIX else COMPRESSED_SUFFIX)
+    os.replace(temporary, path)
+    stale.unlink(missing_ok=True)
+    return path
+
+
+def read_packed(path):
+    '''
+    Read a snapshot. Raw snapshots are memory mapped read-only.
+    '''
+    if path.suffix == COMPRESSED_SUFFIX:
+        deltas = np.frombuffer(zlib.decompress(path.read_bytes()), dtype=_DTYPE)
+        return np.cumsum(deltas, dtype=_DTYPE)
+
+    if path.stat().st_size == 0:
+        return np.empty(0, dtype=_DTYPE)
+    return np.memmap(path, dtype=_DTYPE, mode='r')
+
+
+def remove_packed(database, resource):
+    '''
+    Delete the resource's snapshot, whichever encoding it has.
+    '''
+    for path in packed_paths(database, resource):
+        path.unlink(missing_ok=True)
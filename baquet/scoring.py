@@ -0,0 +1,96 @@
+'''
+Score every user in the directory against a watchlist, in parallel.
+Each worker process reads user databases on its own, from the local cache only.
+'''
+
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from .constants import BaquetConstants
+from .directory import get_directory
+from .helpers import get_watchlist, id_set
+from .user import make_watchlist_report, load_packed_relationships
+from .watchlist import Watchlist
+
+# The watchlist members of a worker process, bound once by _init_worker.
+_WATCHLIST_IDS = None
+
+
+def _init_worker(watchlist):
+    global _WATCHLIST_IDS  # pylint: disable=global-statement
+    _WATCHLIST_IDS = id_set(watchlist)
+
+
+def _read_only_engine(database):
+    '''
+    An engine that opens the database read only. The path goes through
+    as_uri, which escapes characters such as ? and # that would end it.
+    '''
+    uri = f'{Path(database).resolve().as_uri()}?mode=ro'
+    return create_engine('sqlite://', creator=lambda: sqlite3.connect(uri, uri=True))
+
+
+def _score_user(database, user_id):
+    engine = _read_only_engine(database)
+    try:
+        with Session(engine) as session:
+            return make_watchlist_report(
+                session,
+                _WATCHLIST_IDS,
+                user_id,
+                packed=load_packed_relationships(database)
+            )
+    finally:
+        engine.dispose()
+
+
+def iter_scores(watchlist, user_ids=None, users_path='./users/', processes=None):
+    '''
+    Compute the watchlist report of each user, one database per task.
+    The watchlist is read once and handed to every worker when it starts.
+    Defaults to every user in the directory. Users without a database are skipped.
+    Yields WatchlistReportModels as they finish.
+    '''
+    snapshot = sorted(set(get_watchlist(watchlist, kind=BaquetConstants.WATCHLIST)))
+    if user_ids is None:
+        user_ids = get_directory().get_user_ids()
+
+    users_path = Path(users_path).resolve()
+    databases = [
+        (users_path.joinpath(f'{user_id}.db'), str(user_id)) for user_id in user_ids
+    ]
+
+    with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(snapshot,)
+    ) as executor:
+        futures = [
+            executor.submit(_score_user, database, user_id)
+            for database, user_id in databases if database.exists()
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def rank_scores(watchlist, key='friends_watchlist_percent', **kwargs):
+    '''
+    Score users with iter_scores and rank them by one of the
+    WatchlistReportModel attributes, highest first.
+    '''
+    return sorted(
+        iter_scores(watchlist, **kwargs),
+        key=lambda report: (getattr(report, key), report.user_id),
+        reverse=True
+    )
+
+
+if __name__ == '__main__':
+    _KEY = sys.argv[2] if len(sys.argv) > 2 else 'friends_watchlist_percent'
+    for rank, score in enumerate(rank_scores(Watchlist(sys.argv[1]), key=_KEY), start=1):
+        print(f'{rank}\t{score.user_id}\t{getattr(score, _KEY):.4f}')
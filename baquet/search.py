@@ -0,0 +1,214 @@
+'''
+Full-text search across the timelines and favorites of every user in the directory.
+'''
+
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy_pagination import paginate
+from sqlalchemy import table, column, literal_column, text, desc
+from sqlalchemy.sql import func
+
+from .constants import BaquetConstants
+from .migrations import migrate
+from .engines import ENGINES
+from .helpers import search_query_errors
+from .models import (
+    load_model,
+    SearchResultPaginatorModel,
+    SearchUserModel,
+)
+from .sql.search import SearchDocumentsSQL
+
+_SEARCH_FTS = table('search_fts', column('rowid'), column('rank'), column('text'))
+
+# Source table in a user database for each kind of document.
+_SOURCES = {
+    BaquetConstants.TIMELINE: BaquetConstants.TIMELINE,
+    BaquetConstants.FAVORITE: BaquetConstants.FAVORITES,
+}
+
+
+class GlobalSearch:
+    '''
+    One search index over every user database, refreshed incrementally,
+    so that finding who tweeted or liked something does not mean opening every user.
+    '''
+
+    def __init__(self):
+        self._path = Path('./users/')
+        self._engine = None
+        self._conn = self._make_conn()
+
+    def _make_conn(self):
+        database = self._path.joinpath(Path('./search.db'))
+        database.parent.mkdir(parents=True, exist_ok=True)
+        self._engine, session = ENGINES.get(
+            database,
+            setup=lambda engine: migrate(engine, BaquetConstants.SEARCH),
+            owner=self
+        )
+
+        return session
+
+    @contextmanager
+    def _session(self):
+        session = self._conn()
+        try:
+            yield session
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    # INDEX
+
+    def _refresh_source(self, connection, owner_id, kind):
+        source = _SOURCES[kind]
+        indexed_through = connection.execute(
+            text(
+                'SELECT indexed_through FROM search_sources '
+                'WHERE owner_id = :owner_id AND kind = :kind'
+            ),
+            {'owner_id': owner_id, 'kind': kind}
+        ).scalar()
+        newest = connection.execute(
+            text(f'SELECT MAX(last_updated) FROM source.{source}')
+        ).scalar()
+
+        if newest is None or newest == indexed_through:
+            return False
+
+        params = {
+            'owner_id': owner_id,
+            'kind': kind,
+            'since': indexed_through or '',
+        }
+        changed = (
+            f'FROM search_documents AS d JOIN source.{source} AS s '
+            'ON d.tweet_id = s.tweet_id '
+            'WHERE d.owner_id = :owner_id AND d.kind = :kind AND s.last_updated > :since'
+        )
+
+        connection.execute(
+            text(
+                'INSERT OR IGNORE INTO search_documents (owner_id, kind, tweet_id) '
+                f'SELECT :owner_id, :kind, tweet_id FROM source.{source} '
+                'WHERE last_updated > :since'
+            ),
+            params
+        )
+        connection.execute(
+            text(f'DELETE FROM search_fts WHERE rowid IN (SELECT d.doc_id {changed})'),
+            params
+        )
+        connection.execute(
+            text(f'INSERT INTO search_fts (rowid, text) SELECT d.doc_id, s.text {changed}'),
+            params
+        )
+        connection.execute(
+            text(
+                'INSERT INTO search_sources (owner_id, kind, indexed_through, last_updated) '
+                'VALUES (:owner_id, :kind, :newest, :now) '
+                'ON CONFLICT (owner_id, kind) DO UPDATE SET '
+                'indexed_through = excluded.indexed_through, '
+                'last_updated = excluded.last_updated'
+            ),
+            {
+                'owner_id': owner_id,
+                'kind': kind,
+                'newest': newest,
+                'now': datetime.utcnow().isoformat(' '),
+            }
+        )
+        return True
+
+    def refresh_user(self, user_id):
+        '''
+        Index the tweets and likes of one user that changed since the last refresh.
+        Returns whether anything was indexed.
+        '''
+        database = self._path.joinpath(f'{user_id}.db')
+        if not database.exists():
+            return False
+
+        with self._engine.connect() as connection:
+            connection.execute(
+                text('ATTACH DATABASE :database AS source'),
+                {'database': str(database)}
+            )
+            try:
+                refreshed = False
+                for kind in _SOURCES:
+                    refreshed = self._refresh_source(
+                        connection, str(user_id), kind) or refreshed
+                connection.commit()
+            finally:
+                connection.rollback()
+                connection.execute(text('DETACH DATABASE source'))
+
+        return refreshed
+
+    def refresh(self):
+        '''
+        Index whatever changed in every user database.
+        Returns the number of users with changes.
+        '''
+        return sum(
+            1 for database in self._path.glob('*.db')
+            if database.stem.isnumeric() and self.refresh_user(database.stem)
+        )
+
+    # SEARCH
+
+    def _search_query(self, session, query, kind=None):
+        results = session.query(
+            SearchDocumentsSQL.owner_id,
+            SearchDocumentsSQL.kind,
+            SearchDocumentsSQL.tweet_id,
+            _SEARCH_FTS.c.text,
+        ).join(
+            _SEARCH_FTS,
+            _SEARCH_FTS.c.rowid == SearchDocumentsSQL.doc_id
+        ).filter(
+            literal_column(_SEARCH_FTS.name).match(query)
+        )
+
+        if kind:
+            results = results.filter(SearchDocumentsSQL.kind == kind)
+
+        return results
+
+    def search(self, query, page, page_size=20, kind=None):
+        '''
+        Find tweets and likes of every indexed user, best matches first.
+        Takes SQLite FTS5 queries: "a phrase", prefix*, AND, OR, NOT.
+        Limit to timeline or favorite with kind.
+        '''
+        with self._session() as session, search_query_errors(query):
+            results = paginate(
+                self._search_query(session, query, kind).order_by(_SEARCH_FTS.c.rank),
+                page=page,
+                page_size=page_size
+            )
+            return load_model(results, SearchResultPaginatorModel)
+
+    def search_users(self, query, kind=None):
+        '''
+        Find the users that tweeted or liked something matching the query,
+        with the number of matches, most matches first.
+        '''
+        with self._session() as session, search_query_errors(query):
+            matches = func.count().label('matches')
+            results = self._search_query(
+                session, query, kind
+            ).with_entities(
+                SearchDocumentsSQL.owner_id,
+                matches
+            ).group_by(
+                SearchDocumentsSQL.owner_id
+            ).order_by(desc(matches)).all()
+
+            return load_model(results, SearchUserModel, many=True)
@@ -0,0 +1,138 @@
+'''
+Fixed size sketches of friend and follower id sets, for approximate comparisons.
+A HyperLogLog estimates how many ids a set has and a one permutation MinHash
+estimates the Jaccard similarity of two sets, so neither needs the full sets.
+'''
+
+import numpy as np
+
+# HyperLogLog registers are indexed by the top bits of the hash, 2 ** 14 of them.
+_HLL_PRECISION = 14
+_HLL_REGISTERS = 1 << _HLL_PRECISION
+# MinHash bins are indexed by the top bits of a second hash, 2 ** 10 of them.
+_MINHASH_PRECISION = 10
+_MINHASH_BINS = 1 << _MINHASH_PRECISION
+_EMPTY = np.uint64(np.iinfo(np.uint64).max)
+
+
+def _mix(values):
+    # splitmix64 finalizer, spreads sequential ids over the whole 64 bits.
+    with np.errstate(over='ignore'):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def _leading_zeros(values):
+    values = values.copy()
+    zeros = np.zeros(values.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        empty = (values >> np.uint64(64 - shift)) == 0
+        zeros[empty] += shift
+        values[empty] <<= np.uint64(shift)
+    zeros[values == 0] += 1
+    return zeros
+
+
+class RelationshipSketch:
+    '''
+    HyperLogLog and MinHash of one set of user ids.
+    Build with update, in as many chunks as needed.
+    '''
+
+    def __init__(self, hll=None, minhash=None):
+        self.hll = (
+            np.frombuffer(hll, dtype=np.uint8).copy() if hll is not None else
+            np.zeros(_HLL_REGISTERS, dtype=np.uint8)
+        )
+        self.minhash = (
+            np.frombuffer(minhash, dtype='<u8').copy() if minhash is not None else
+            np.full(_MINHASH_BINS, _EMPTY, dtype=np.uint64)
+        )
+
+    @classmethod
+    def from_ids(cls, ids):
+        '''
+        Sketch a whole set of user ids at once.
+        '''
+        sketch = cls()
+        sketch.update(ids)
+        return sketch
+
+    def update(self, ids):
+        '''
+        Add user ids to the sketch.
+        '''
+        hashes = _mix(np.asarray(ids, dtype=np.int64).view(np.uint64))
+        if not hashes.size:
+            return
+
+        registers = (hashes >> np.uint64(64 - _HLL_PRECISION)).astype(np.intp)
+        ranks = np.minimum(
+            _leading_zeros(hashes << np.uint64(_HLL_PRECISION)) + 1,
+            64 - _HLL_PRECISION + 1
+        ).astype(np.uint8)
+        np.maximum.at(self.hll, registers, ranks)
+
+        hashes = _mix(hashes)
+        bins = (hashes >> np.uint64(64 - _MINHASH_PRECISION)).astype(np.intp)
+        np.minimum.at(self.minhash, bins, hashes)
+
+    def to_bytes(self):
+        '''
+        The (hll, minhash) bytes to store.
+        '''
+        return self.hll.tobytes(), self.minhash.astype('<u8').tobytes()
+
+    def cardinality(self):
+        '''
+        Estimate the number of ids in the set.
+        '''
+        registers = self.hll.astype(np.float64)
+        alpha = 0.7213 / (1 + 1.079 / _HLL_REGISTERS)
+        estimate = alpha * _HLL_REGISTERS ** 2 / np.sum(np.exp2(-registers))
+
+        empty = np.count_nonzero(self.hll == 0)
+        if estimate <= 2.5 * _HLL_REGISTERS and empty:
+            estimate = _HLL_REGISTERS * np.log(_HLL_REGISTERS / empty)
+        return float(estimate)
+
+    def union(self, other):
+        '''
+        The sketch of both sets together.
+        '''
+        sketch = RelationshipSketch()
+        sketch.hll = np.maximum(self.hll, other.hll)
+        sketch.minhash = np.minimum(self.minhash, other.minhash)
+        return sketch
+
+    def jaccard(self, other):
+        '''
+        Estimate the size of the intersection over the size of the union.
+        '''
+        return float(_jaccard(self.minhash, other.minhash))
+
+    def overlap(self, other):
+        '''
+        Estimate the number of ids in both sets.
+        Least accurate when one set is much smaller than the other.
+        '''
+        similarity = self.jaccard(other)
+        return similarity * self.union(other).cardinality()
+
+
+def _jaccard(minhash, others):
+    # Bins empty in both say nothing about the sets, see one permutation hashing.
+    filled = np.count_nonzero((minhash != _EMPTY) | (others != _EMPTY), axis=-1)
+    matches = np.count_nonzero((minhash == others) & (minhash != _EMPTY), axis=-1)
+    return matches / np.maximum(filled, 1)
+
+
+def similarity_matrix(sketches):
+    '''
+    Estimate the Jaccard similarity of every pair of sketches,
+    as a square array in the order given.
+    '''
+    signatures = np.stack([sketch.minhash for sketch in sketches])
+    return np.stack([_jaccard(signature, signatures) for signature in signatures])
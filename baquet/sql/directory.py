@@ -70,18 +70,9 @@ class CacheSQL(BASE):
     profile_banner_url = Column(String)
     profile_image_url = Column(String)
     protected = Column(Boolean)
-    screen_name = Column(String)
+    screen_name = Column(String, index=True)
     statuses_count = Column(Integer)
     suspended = Column(Boolean)
     url = Column(String)
     verified = Column(Boolean)
     last_updated = Column(DateTime)
-
-
-class TempJoinSQL(BASE):
-    '''
-    Table to temporarily join data, rather than using in_().
-    '''
-    __tablename__ = 'temp_joins'
-    join_id = Column(String, primary_key=True)
-    join_on = Column(String, primary_key=True)
@@ -0,0 +1,385 @@
+'''
+The tables each migration step introduced, frozen as they were when the step was released.
+Never edit these, change the models and add a migration step with its own tables instead.
+'''
+
+from sqlalchemy import (
+    MetaData,
+    Table,
+    Column,
+    ForeignKey,
+    Index,
+    Boolean,
+    DateTime,
+    Integer,
+    LargeBinary,
+    String,
+)
+
+from .helpers.custom_types import GUID
+
+# User databases: the original schema, plus sync state, relationship staging and
+# changes, and secondary indexes. temp_joins is dropped again by version 3.
+USER_V1 = MetaData()
+
+Table(
+    'favorites',
+    USER_V1,
+    Column('created_at', DateTime),
+    Column('entities', String),
+    Column('favorite_count', Integer),
+    Column('tweet_id', String, primary_key=True),
+    Column('is_quote_status', Boolean),
+    Column('lang', String),
+    Column('possibly_sensitive', Boolean),
+    Column('retweet_count', Integer),
+    Column('source', String),
+    Column('source_url', String),
+    Column('text', String),
+    Column('user_id', String, index=True),
+    Column('screen_name', String),
+    Column('name', String),
+    Column('last_updated', DateTime, index=True),
+    Index('ix_favorites_created_at_tweet_id', 'created_at', 'tweet_id'),
+)
+
+Table(
+    'followers',
+    USER_V1,
+    Column('user_id', String, primary_key=True),
+    Column('last_updated', DateTime, index=True),
+)
+
+Table(
+    'friends',
+    USER_V1,
+    Column('user_id', String, primary_key=True),
+    Column('last_updated', DateTime, index=True),
+)
+
+Table(
+    'list_memberships',
+    USER_V1,
+    Column('list_id', String, primary_key=True),
+    Column('name', String),
+    Column('last_updated', DateTime, index=True),
+)
+
+Table(
+    'relationship_changes',
+    USER_V1,
+    Column('kind', String, primary_key=True),
+    Column('user_id', String, primary_key=True),
+    Column('added', Boolean),
+    Column('last_updated', DateTime),
+)
+
+Table(
+    'relationship_staging',
+    USER_V1,
+    Column('kind', String, primary_key=True),
+    Column('user_id', String, primary_key=True),
+)
+
+Table(
+    'sync_state',
+    USER_V1,
+    Column('resource', String, primary_key=True),
+    Column('newest_id', String),
+    Column('oldest_id', String),
+    Column('next_cursor', String),
+    Column('row_count', Integer),
+    Column('last_updated', DateTime),
+)
+
+Table(
+    'tags',
+    USER_V1,
+    Column('tag_id', Integer, primary_key=True),
+    Column('text', String),
+)
+
+Table(
+    'temp_joins',
+    USER_V1,
+    Column('join_id', String, primary_key=True),
+    Column('join_on', String, primary_key=True),
+)
+
+Table(
+    'timeline',
+    USER_V1,
+    Column('created_at', DateTime),
+    Column('entities', String),
+    Column('favorite_count', Integer),
+    Column('tweet_id', String, primary_key=True),
+    Column('is_quote_status', Boolean),
+    Column('lang', String),
+    Column('possibly_sensitive', Boolean),
+    Column('retweet_count', Integer),
+    Column('source', String),
+    Column('source_url', String),
+    Column('text', String),
+    Column('retweet_user_id', String, index=True),
+    Column('retweet_screen_name', String),
+    Column('retweet_name', String),
+    Column('user_id', String, index=True),
+    Column('screen_name', String),
+    Column('name', String),
+    Column('last_updated', DateTime, index=True),
+    Index('ix_timeline_created_at_tweet_id', 'created_at', 'tweet_id'),
+)
+
+Table(
+    'user_notes',
+    USER_V1,
+    Column('note_id', GUID, primary_key=True),
+    Column('text', String),
+    Column('created_at', DateTime),
+)
+
+Table(
+    'users',
+    USER_V1,
+    Column('contributors_enabled', Boolean),
+    Column('created_at', DateTime),
+    Column('default_profile', Boolean),
+    Column('default_profile_image', Boolean),
+    Column('description', String),
+    Column('entities', String),
+    Column('favorites_count', Integer),
+    Column('followers_count', Integer),
+    Column('friends_count', Integer),
+    Column('geo_enabled', Boolean),
+    Column('has_extended_profile', Boolean),
+    Column('user_id', String, primary_key=True),
+    Column('is_translation_enabled', Boolean),
+    Column('is_translator', Boolean),
+    Column('lang', String),
+    Column('listed_count', Integer),
+    Column('location', String),
+    Column('name', String),
+    Column('needs_phone_verification', Boolean),
+    Column('profile_banner_url', String),
+    Column('profile_image_url', String),
+    Column('protected', Boolean),
+    Column('screen_name', String),
+    Column('statuses_count', Integer),
+    Column('suspended', Boolean),
+    Column('url', String),
+    Column('verified', Boolean),
+    Column('last_updated', DateTime, index=True),
+)
+
+Table(
+    'favorite_notes',
+    USER_V1,
+    Column('tweet_id', String, ForeignKey('favorites.tweet_id'), primary_key=True),
+    Column('note_id', GUID, primary_key=True),
+    Column('text', String),
+    Column('created_at', DateTime),
+)
+
+Table(
+    'favorite_tags',
+    USER_V1,
+    Column('tweet_id', String, ForeignKey('favorites.tweet_id'), primary_key=True),
+    Column('tag_id', Integer, ForeignKey('tags.tag_id'), primary_key=True),
+)
+
+Table(
+    'timeline_notes',
+    USER_V1,
+    Column('tweet_id', String, ForeignKey('timeline.tweet_id'), primary_key=True),
+    Column('note_id', GUID, primary_key=True),
+    Column('text', String),
+    Column('created_at', DateTime),
+)
+
+Table(
+    'timeline_tags',
+    USER_V1,
+    Column('tweet_id', String, ForeignKey('timeline.tweet_id'), primary_key=True),
+    Column('tag_id', Integer, ForeignKey('tags.tag_id'), primary_key=True),
+)
+
+
+# User databases: relationship sketches.
+USER_V4 = MetaData()
+
+Table(
+    'relationship_sketches',
+    USER_V4,
+    Column('resource', String, primary_key=True),
+    Column('hll', LargeBinary),
+    Column('minhash', LargeBinary),
+    Column('last_updated', DateTime),
+)
+
+
+# Directory databases: the original schema and secondary indexes.
+# temp_joins is dropped again by version 2.
+DIRECTORY_V1 = MetaData()
+
+Table(
+    'cache',
+    DIRECTORY_V1,
+    Column('contributors_enabled', Boolean),
+    Column('created_at', DateTime),
+    Column('default_profile', Boolean),
+    Column('default_profile_image', Boolean),
+    Column('description', String),
+    Column('entities', String),
+    Column('favorites_count', Integer),
+    Column('followers_count', Integer),
+    Column('friends_count', Integer),
+    Column('geo_enabled', Boolean),
+    Column('has_extended_profile', Boolean),
+    Column('user_id', String, primary_key=True),
+    Column('is_translation_enabled', Boolean),
+    Column('is_translator', Boolean),
+    Column('lang', String),
+    Column('listed_count', Integer),
+    Column('location', String),
+    Column('name', String),
+    Column('needs_phone_verification', Boolean),
+    Column('profile_banner_url', String),
+    Column('profile_image_url', String),
+    Column('protected', Boolean),
+    Column('screen_name', String, index=True),
+    Column('statuses_count', Integer),
+    Column('suspended', Boolean),
+    Column('url', String),
+    Column('verified', Boolean),
+    Column('last_updated', DateTime),
+)
+
+Table(
+    'directory',
+    DIRECTORY_V1,
+    Column('contributors_enabled', Boolean),
+    Column('created_at', DateTime),
+    Column('default_profile', Boolean),
+    Column('default_profile_image', Boolean),
+    Column('description', String),
+    Column('entities', String),
+    Column('favorites_count', Integer),
+    Column('followers_count', Integer),
+    Column('friends_count', Integer),
+    Column('geo_enabled', Boolean),
+    Column('has_extended_profile', Boolean),
+    Column('user_id', String, primary_key=True),
+    Column('is_translation_enabled', Boolean),
+    Column('is_translator', Boolean),
+    Column('lang', String),
+    Column('listed_count', Integer),
+    Column('location', String),
+    Column('name', String),
+    Column('needs_phone_verification', Boolean),
+    Column('profile_banner_url', String),
+    Column('profile_image_url', String),
+    Column('protected', Boolean),
+    Column('screen_name', String),
+    Column('statuses_count', Integer),
+    Column('suspended', Boolean),
+    Column('url', String),
+    Column('verified', Boolean),
+    Column('last_updated', DateTime),
+)
+
+Table(
+    'temp_joins',
+    DIRECTORY_V1,
+    Column('join_id', String, primary_key=True),
+    Column('join_on', String, primary_key=True),
+)
+
+
+# Watchlist databases: the original schema.
+WATCHLIST_V1 = MetaData()
+
+Table(
+    'sublist_types',
+    WATCHLIST_V1,
+    Column('sublist_type_id', String, primary_key=True),
+    Column('name', String),
+)
+
+Table(
+    'watchlist',
+    WATCHLIST_V1,
+    Column('contributors_enabled', Boolean),
+    Column('created_at', DateTime),
+    Column('default_profile', Boolean),
+    Column('default_profile_image', Boolean),
+    Column('description', String),
+    Column('entities', String),
+    Column('favorites_count', Integer),
+    Column('followers_count', Integer),
+    Column('friends_count', Integer),
+    Column('geo_enabled', Boolean),
+    Column('has_extended_profile', Boolean),
+    Column('user_id', String, primary_key=True),
+    Column('is_translation_enabled', Boolean),
+    Column('is_translator', Boolean),
+    Column('lang', String),
+    Column('listed_count', Integer),
+    Column('location', String),
+    Column('name', String),
+    Column('needs_phone_verification', Boolean),
+    Column('profile_banner_url', String),
+    Column('profile_image_url', String),
+    Column('protected', Boolean),
+    Column('screen_name', String),
+    Column('statuses_count', Integer),
+    Column('suspended', Boolean),
+    Column('url', String),
+    Column('verified', Boolean),
+    Column('last_updated', DateTime),
+)
+
+Table(
+    'watchwords',
+    WATCHLIST_V1,
+    Column('regex', String, primary_key=True),
+)
+
+Table(
+    'sublists',
+    WATCHLIST_V1,
+    Column('sublist_id', Integer, primary_key=True),
+    Column('sublist_type_id', Integer, ForeignKey('sublist_types.sublist_type_id')),
+    Column('name', String),
+    Column('external_id', String),
+)
+
+Table(
+    'user_sublists',
+    WATCHLIST_V1,
+    Column('user_id', String, ForeignKey('watchlist.user_id'), primary_key=True),
+    Column('sublist_id', Integer, ForeignKey('sublists.sublist_id'), primary_key=True),
+    Column('locally_excluded', Boolean),
+)
+
+
+# The global search database.
+SEARCH_V1 = MetaData()
+
+Table(
+    'search_documents',
+    SEARCH_V1,
+    Column('doc_id', Integer, primary_key=True),
+    Column('owner_id', String),
+    Column('kind', String),
+    Column('tweet_id', String),
+    Index('ix_search_documents_owner_id_kind_tweet_id', 'owner_id', 'kind', 'tweet_id', unique=True),
+)
+
+Table(
+    'search_sources',
+    SEARCH_V1,
+    Column('owner_id', String, primary_key=True),
+    Column('kind', String, primary_key=True),
+    Column('indexed_through', String),
+    Column('last_updated', DateTime),
+)
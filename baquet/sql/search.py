@@ -0,0 +1,40 @@
+'''
+Global search index across every user in the users folder.
+The FTS5 table holding the text is created by the migrations.
+'''
+
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from sqlalchemy.ext.declarative import declarative_base
+
+BASE = declarative_base()
+
+
+class SearchDocumentsSQL(BASE):
+    '''
+    A tweet or like of a user, the rowid of its text in search_fts.
+    '''
+    __tablename__ = 'search_documents'
+    __table_args__ = (
+        Index(
+            'ix_search_documents_owner_id_kind_tweet_id',
+            'owner_id',
+            'kind',
+            'tweet_id',
+            unique=True
+        ),
+    )
+    doc_id = Column(Integer, primary_key=True)
+    owner_id = Column(String)
+    kind = Column(String)
+    tweet_id = Column(String)
+
+
+class SearchSourcesSQL(BASE):
+    '''
+    How far each user's timeline and favorites have been indexed.
+    '''
+    __tablename__ = 'search_sources'
+    owner_id = Column(String, primary_key=True)
+    kind = Column(String, primary_key=True)
+    indexed_through = Column(String)
+    last_updated = Column(DateTime)
@@ -3,7 +3,16 @@ Model for a user's info, stores information of interest.
 '''
 
 import uuid
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Boolean,
+    DateTime,
+    ForeignKey,
+    Index,
+    LargeBinary,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from .helpers.custom_types import GUID
@@ -16,6 +25,9 @@ class FavoritesSQL(BASE):
     Tweets this user has liked.
     '''
     __tablename__ = 'favorites'
+    __table_args__ = (
+        Index('ix_favorites_created_at_tweet_id', 'created_at', 'tweet_id'),
+    )
     created_at = Column(DateTime)
     entities = Column(String)
     favorite_count = Column(Integer)
@@ -27,10 +39,10 @@ class FavoritesSQL(BASE):
     source = Column(String)
     source_url = Column(String)
     text = Column(String)
-    user_id = Column(String)
+    user_id = Column(String, index=True)
     screen_name = Column(String)
     name = Column(String)
-    last_updated = Column(DateTime)
+    last_updated = Column(DateTime, index=True)
 
 
 class TimelineSQL(BASE):
@@ -38,6 +50,9 @@ class TimelineSQL(BASE):
     Tweets authored by this user and retweets.
     '''
     __tablename__ = 'timeline'
+    __table_args__ = (
+        Index('ix_timeline_created_at_tweet_id', 'created_at', 'tweet_id'),
+    )
     created_at = Column(DateTime)
     entities = Column(String)
     favorite_count = Column(Integer)
@@ -49,13 +64,13 @@ class TimelineSQL(BASE):
     source = Column(String)
     source_url = Column(String)
     text = Column(String)
-    retweet_user_id = Column(String)
+    retweet_user_id = Column(String, index=True)
     retweet_screen_name = Column(String)
     retweet_name = Column(String)
-    user_id = Column(String)
+    user_id = Column(String, index=True)
     screen_name = Column(String)
     name = Column(String)
-    last_updated = Column(DateTime)
+    last_updated = Column(DateTime, index=True)
 
 
 class UsersSQL(BASE):
@@ -90,7 +105,7 @@ class UsersSQL(BASE):
     suspended = Column(Boolean)
     url = Column(String)
     verified = Column(Boolean)
-    last_updated = Column(DateTime)
+    last_updated = Column(DateTime, index=True)
 
 
 class FollowersSQL(BASE):
@@ -99,7 +114,7 @@ class FollowersSQL(BASE):
     '''
     __tablename__ = 'followers'
     user_id = Column(String, primary_key=True)
-    last_updated = Column(DateTime)
+    last_updated = Column(DateTime, index=True)
 
 
 class FriendsSQL(BASE):
@@ -108,9 +123,29 @@ class FriendsSQL(BASE):
     '''
     __tablename__ = 'friends'
     user_id = Column(String, primary_key=True)
+    last_updated = Column(DateTime, index=True)
+
+
+class RelationshipChangesSQL(BASE):
+    '''
+    Friends and followers added or removed by the last refresh.
+    '''
+    __tablename__ = 'relationship_changes'
+    kind = Column(String, primary_key=True)
+    user_id = Column(String, primary_key=True)
+    added = Column(Boolean)
     last_updated = Column(DateTime)
 
 
+class RelationshipStagingSQL(BASE):
+    '''
+    Friend and follower ids fetched so far by an unfinished refresh.
+    '''
+    __tablename__ = 'relationship_staging'
+    kind = Column(String, primary_key=True)
+    user_id = Column(String, primary_key=True)
+
+
 class TagsSQL(BASE):
     '''
     Store all unique tags.
@@ -188,13 +223,30 @@ class ListMembershipsSQL(BASE):
     __tablename__ = 'list_memberships'
     list_id = Column(String, primary_key=True)
     name = Column(String)
+    last_updated = Column(DateTime, index=True)
+
+
+class SyncStateSQL(BASE):
+    '''
+    When each resource (named after its table) was last fetched,
+    the cursors to continue fetching from and how many rows it holds.
+    '''
+    __tablename__ = 'sync_state'
+    resource = Column(String, primary_key=True)
+    newest_id = Column(String)
+    oldest_id = Column(String)
+    next_cursor = Column(String)
+    row_count = Column(Integer)
     last_updated = Column(DateTime)
 
 
-class TempJoinSQL(BASE):
+class RelationshipSketchesSQL(BASE):
     '''
-    Table to temporarily join data, rather than using in_().
+    HyperLogLog and MinHash sketches of friends and followers,
+    rebuilt each time they are refreshed.
     '''
-    __tablename__ = 'temp_joins'
-    join_id = Column(String, primary_key=True)
-    join_on = Column(String, primary_key=True)
+    __tablename__ = 'relationship_sketches'
+    resource = Column(String, primary_key=True)
+    hll = Column(LargeBinary)
+    minhash = Column(LargeBinary)
+    last_updated = Column(DateTime)
@@ -4,13 +4,31 @@ All of the operations needed to support fetching and filtering Twitter user info
 
 from contextlib import contextmanager
 from datetime import datetime
+from math import sqrt
 from pathlib import Path
-import uuid
-
-from sqlalchemy_pagination import paginate
-from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import create_engine, and_, or_, desc
+from statistics import NormalDist
+
+from sqlalchemy_pagination import paginate, Page
+from sqlalchemy.orm import Session
+from sqlalchemy import (
+    event,
+    and_,
+    or_,
+    desc,
+    insert,
+    select,
+    cast,
+    literal,
+    literal_column,
+    table,
+    column,
+    text,
+    Boolean,
+    DateTime,
+    Integer,
+)
 from sqlalchemy.sql import func
+import numpy as np
 import tweepy
 
 from .models import (
@@ -20,28 +38,51 @@ from .models import (
     ListMembershipsModel,
     NoteModel,
     TagModel,
+    TweetModel,
     TweetPaginatorModel,
-    RelationshipPaginatorModel
+    TweetCursorPaginatorModel,
+    BaseRelationshipModel,
+    RelationshipPaginatorModel,
+    RelationshipCursorPaginatorModel,
+    WatchlistReportModel,
+    WatchlistEstimateModel,
 )
-from .directory import Directory, hydrate_user_identifiers
+from .analytics import to_ids, get_watchlist_ids, intersect, difference, count_common
+from .directory import get_directory, hydrate_user_identifiers
+from .watchlist import Watchlist, watchlist_members
+from .migrations import migrate, rebuild_search_index
+from .engines import ENGINES
+from .packed import find_packed, read_packed, stage_packed, swap_packed, remove_packed
+from .sketches import RelationshipSketch
 from .constants import BaquetConstants
 from .helpers import(
-    make_api,
-    make_config,
-    filter_for_watchwords,
+    get_api,
+    filter_by_watchwords,
+    set_matched_watchwords,
+    register_regexp,
     get_watchlist,
+    id_set,
     transform_user,
     transform_tweet,
-    serialize_entities,
-    serialize_paginated_entities
+    bulk_upsert,
+    keyset_paginate,
+    KeysetPage,
+    encode_cursor,
+    decode_cursor,
+    row_columns,
+    stream_models,
+    require_search_index,
+    search_query_errors,
 )
 from .sql.user import (
-    BASE as USER_BASE,
     UsersSQL,
     TimelineSQL,
     FavoritesSQL,
     FriendsSQL,
     FollowersSQL,
+    RelationshipChangesSQL,
+    RelationshipStagingSQL,
+    RelationshipSketchesSQL,
     TagsSQL,
     TimelineTagsSQL,
     FavoritesTagsSQL,
@@ -49,46 +90,151 @@ from .sql.user import (
     FavoritesNotesSQL,
     UserNotesSQL,
     ListMembershipsSQL,
-    TempJoinSQL as UserTempJoinSQL,
+    SyncStateSQL,
 )
 
 
+# Schema name of a watchlist database attached to a user connection.
+_WATCHLIST_SCHEMA = 'watchlist_db'
+
+# Staged ids read at a time while sketching friends or followers.
+_SKETCH_BATCH_SIZE = 50000
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator != 0 else 0
+
+
+def _count(model, *criteria):
+    return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+
+def _count_on_watchlist(column, ids, *criteria):
+    return select(func.count()).select_from(column.table).join(
+        ids, column == ids.c.value
+    ).where(*criteria).scalar_subquery()
+
+
+def wilson_interval(hits, sample_size, confidence=0.95):
+    '''
+    Wilson score interval of a proportion. Returns (lower, upper).
+    '''
+    if not sample_size:
+        return 0.0, 1.0
+
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    proportion = hits / sample_size
+
+    denominator = 1 + z ** 2 / sample_size
+    center = (proportion + z ** 2 / (2 * sample_size)) / denominator
+    margin = z / denominator * sqrt(
+        proportion * (1 - proportion) / sample_size + z ** 2 / (4 * sample_size ** 2)
+    )
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def make_watchlist_report(session, ids, user_id=None, packed=None):
+    '''
+    Compute every watchlist metric of a user database in a single statement.
+    The watchlist members are joined on `c.value`, see User._watchlist_session.
+    Friends or followers stored packed are counted from their arrays,
+    given in packed by table name.
+    '''
+    counts = session.execute(
+        select(
+            _count(ids).label('watchlist_size'),
+            _count(
+                TimelineSQL,
+                TimelineSQL.retweet_user_id != None  # pylint: disable=singleton-comparison
+            ).label('retweets'),
+            _count_on_watchlist(TimelineSQL.retweet_user_id, ids).label('retweets_on_watchlist'),
+            _count(FavoritesSQL).label('favorites'),
+            _count_on_watchlist(FavoritesSQL.user_id, ids).label('favorites_on_watchlist'),
+            _count(FriendsSQL).label('friends'),
+            _count_on_watchlist(FriendsSQL.user_id, ids).label('friends_on_watchlist'),
+            _count(FollowersSQL).label('followers'),
+            _count_on_watchlist(FollowersSQL.user_id, ids).label('followers_on_watchlist'),
+        )
+    ).one()._asdict()
+
+    if packed:
+        watchlist_ids = to_ids(session.execute(select(ids.c.value)).scalars())
+        for resource, relationship_ids in packed.items():
+            counts[resource] = len(relationship_ids)
+            counts[f'{resource}_on_watchlist'] = count_common(relationship_ids, watchlist_ids)
+
+    return WatchlistReportModel(
+        user_id=user_id,
+        retweet_watchlist_percent=_ratio(counts['retweets_on_watchlist'], counts['retweets']),
+        favorite_watchlist_percent=_ratio(counts['favorites_on_watchlist'], counts['favorites']),
+        friends_watchlist_percent=_ratio(counts['friends_on_watchlist'], counts['friends']),
+        friends_watchlist_completion=_ratio(
+            counts['friends_on_watchlist'], counts['watchlist_size']),
+        followers_watchlist_percent=_ratio(counts['followers_on_watchlist'], counts['followers']),
+        followers_watchlist_completion=_ratio(
+            counts['followers_on_watchlist'], counts['watchlist_size']),
+        **counts
+    )
+
+
+def _setup_user_engine(engine):
+    event.listen(engine, 'connect', register_regexp)
+    migrate(engine, BaquetConstants.USER)
+
+
+def load_packed_relationships(database):
+    '''
+    Read the friends and followers a user database keeps packed, by table name.
+    '''
+    packed = {}
+    for model in (FriendsSQL, FollowersSQL):
+        path = find_packed(database, model.__tablename__)
+        if path:
+            packed[model.__tablename__] = read_packed(path)
+    return packed
+
+
 class User:
     '''
     With a user object, you can read, filter, and store Twitter data.
     '''
 
-    def __init__(self, user_id, limit=100, cache_expiry=86400):
+    def __init__(
+            self,
+            user_id,
+            limit=100,
+            cache_expiry=86400,
+            relationship_storage=BaquetConstants.STORAGE_TABLE
+    ):
         self._user_id = user_id
         self._limit = limit
         self._cache_expiry = cache_expiry
+        # Where friends and followers are written on refresh. Whatever
+        # was stored before is read until then.
+        self._relationship_storage = relationship_storage
+        self._database = Path(f'./users/{self._user_id}.db')
+        self._engine = None
         self._conn = self._make_conn()
 
     def _cache_expired(self, table):
-        connection = self._conn()
-        last_updated = connection.query(func.max(table.last_updated)).scalar()
+        with self._session() as session:
+            last_updated = session.query(SyncStateSQL.last_updated).filter(
+                SyncStateSQL.resource == table.__tablename__
+            ).scalar()
         elapsed = datetime.utcnow() - last_updated if last_updated else None
-        connection.close()
-        return not elapsed or elapsed.seconds > self._cache_expiry
+        return not elapsed or elapsed.total_seconds() > self._cache_expiry
 
     def _make_conn(self):
-        database = Path(f'./users/{self._user_id}.db')
-        engine = create_engine(
-            f'sqlite:///{database}',
-            connect_args={"check_same_thread": False}
-        )
-        session_factory = sessionmaker(
-            autocommit=False,
-            autoflush=False,
-            bind=engine
-        )
-        session = scoped_session(
-            session_factory
+        database = self._database
+        database.parent.mkdir(parents=True, exist_ok=True)
+        engine, session = ENGINES.get(
+            database,
+            setup=_setup_user_engine,
+            # uri lets a watchlist database be attached read-only.
+            connect_args={"uri": True},
+            owner=self
         )
-
-        if not database.exists():
-            database.parent.mkdir(parents=True, exist_ok=True)
-            USER_BASE.metadata.create_all(engine)
+        self._engine = engine
 
         return session
 
@@ -103,34 +249,655 @@ class User:
         finally:
             session.close()
 
-    # USER
+    @contextmanager
+    def _stream_session(self):
+        '''
+        A session of its own, not the thread's scoped session,
+        so that calls made while a stream is read do not close it.
+        '''
+        session = Session(bind=self._engine, autoflush=False)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    @contextmanager
+    def _watchlist_session(self, watchlist, exclude_self=False, stream=False):
+        '''
+        A session along with the watchlist members to join against, on `c.value`.
+        A Watchlist's database is attached read-only and joined in place,
+        a list of user ids is bound as a parameter. Members are None without a watchlist.
+        '''
+        if not isinstance(watchlist, Watchlist):
+            ids = None
+            if watchlist is not None:
+                ids = id_set(
+                    user_id for user_id in get_watchlist(
+                        watchlist,
+                        kind=BaquetConstants.WATCHLIST
+                    ) if not exclude_self or user_id != self._user_id
+                )
+            with self._stream_session() if stream else self._session() as session:
+                yield session, ids
+            return
+
+        with self._engine.connect() as connection:
+            connection.execute(
+                text(f'ATTACH DATABASE :database AS {_WATCHLIST_SCHEMA}'),
+                {'database': f'{watchlist.get_database().resolve().as_uri()}?mode=ro'}
+            )
+            try:
+                members = watchlist_members(_WATCHLIST_SCHEMA).subquery()
+                ids = select(members.c.user_id.label('value'))
+                if exclude_self:
+                    ids = ids.where(members.c.user_id != self._user_id)
+
+                session = Session(bind=connection, autoflush=False)
+                try:
+                    yield session, ids.subquery()
+                finally:
+                    session.close()
+            finally:
+                connection.rollback()
+                connection.execute(text(f'DETACH DATABASE {_WATCHLIST_SCHEMA}'))
+
+    def _get_sync_state(self, session, resource):
+        state = session.query(SyncStateSQL).filter(
+            SyncStateSQL.resource == resource
+        ).first()
+
+        if not state:
+            state = SyncStateSQL(resource=resource)
+            session.add(state)
+
+        return state
+
+    def _mark_synced(self, session, model, row_count=None, complete=True):
+        '''
+        Record a completed fetch of the model's table.
+        Without a row count, the table is counted.
+        When the fetch is not complete, last_updated is cleared,
+        so that the cache is expired until a fetch completes.
+        '''
+        if row_count is None:
+            session.flush()
+            row_count = session.query(func.count()).select_from(model).scalar()
 
-    def _add_temp_join(self, join_data):
-        join_id = uuid.uuid4().hex
-        join = [UserTempJoinSQL(join_id=join_id, join_on=j) for j in join_data]
+        state = self._get_sync_state(session, model.__tablename__)
+        state.row_count = row_count
+        state.last_updated = datetime.utcnow() if complete else None
+        return state
 
+    def _fetch_tweets(self, method, backfill=False):
+        '''
+        Fetch only the timeline tweets we do not have yet.
+        By default, ask for tweets newer than the newest one stored.
+        When more than `limit` are newer, the rest are a gap, fetched from below
+        the lowest one fetched before newest_id moves, up to MAX_GAP_FETCHES
+        times. A gap still open after that leaves the cache expired.
+        When backfilling, walk backwards from the oldest one stored instead.
+        '''
+        for _ in range(1 if backfill else BaquetConstants.MAX_GAP_FETCHES):
+            with self._session() as session:
+                gap_open = self._fetch_tweets_once(session, method, backfill)
+                self._mark_synced(session, TimelineSQL, complete=not gap_open)
+                session.commit()
+
+            if not gap_open:
+                return
+
+    def _fetch_tweets_once(self, session, method, backfill):
+        '''
+        Make one fetch of up to `limit` tweets, see _fetch_tweets.
+        Returns whether a gap is left open.
+        '''
+        state = self._get_sync_state(session, TimelineSQL.__tablename__)
+
+        cursor_args = {}
+        if backfill and state.oldest_id:
+            cursor_args['max_id'] = int(state.oldest_id) - 1
+        elif not backfill and state.newest_id:
+            cursor_args['since_id'] = state.newest_id
+            if state.next_cursor:
+                cursor_args['max_id'] = state.next_cursor
+
+        tweets = [
+            transform_tweet(tweet, kind=BaquetConstants.TIMELINE) for tweet in tweepy.Cursor(
+                method,
+                id=self._user_id,
+                tweet_mode="extended",
+                **cursor_args
+            ).items(self._limit)
+        ]
+        bulk_upsert(session, TimelineSQL, tweets)
+
+        tweet_ids = [int(tweet.tweet_id) for tweet in tweets]
+
+        if not backfill and state.newest_id:
+            if len(tweets) >= self._limit:
+                # There may be more between newest_id and the lowest fetched.
+                state.next_cursor = str(min(tweet_ids) - 1)
+            else:
+                # The gap is closed, everything up to the newest stored is here.
+                state.next_cursor = None
+                newest_stored = session.query(
+                    func.max(cast(TimelineSQL.tweet_id, Integer))
+                ).scalar()
+                if newest_stored:
+                    tweet_ids.append(newest_stored)
+                tweet_ids.append(int(state.newest_id))
+                state.newest_id = str(max(tweet_ids))
+        elif tweet_ids:
+            if state.newest_id:
+                tweet_ids.append(int(state.newest_id))
+            state.newest_id = str(max(tweet_ids))
+
+        if tweet_ids:
+            if state.oldest_id:
+                tweet_ids.append(int(state.oldest_id))
+            state.oldest_id = str(min(tweet_ids))
+
+        return state.next_cursor is not None
+
+    def _fetch_likes(self, method, backfill=False):
+        '''
+        Fetch up to `limit` likes, most recently liked first.
+        Likes are not in tweet id order, a new like can be of an old tweet,
+        so pages are read until one holds only likes already stored.
+        When backfilling, ask for tweets older than the oldest one stored instead.
+        '''
         with self._session() as session:
-            session.bulk_save_objects(join)
+            state = self._get_sync_state(session, FavoritesSQL.__tablename__)
+
+            cursor_args = {}
+            if backfill and state.oldest_id:
+                cursor_args['max_id'] = int(state.oldest_id) - 1
+
+            likes = []
+            pages = tweepy.Cursor(
+                method,
+                id=self._user_id,
+                tweet_mode="extended",
+                count=min(self._limit, BaquetConstants.FAVORITES_PAGE_SIZE),
+                **cursor_args
+            ).pages()
+            for page in pages:
+                page = [
+                    transform_tweet(tweet, kind=BaquetConstants.FAVORITE) for tweet in page
+                ][:self._limit - len(likes)]
+                likes.extend(page)
+
+                stored = session.query(func.count()).select_from(FavoritesSQL).filter(
+                    FavoritesSQL.tweet_id.in_([like.tweet_id for like in page])
+                ).scalar()
+                if len(likes) >= self._limit or (not backfill and stored == len(page)):
+                    break
+            bulk_upsert(session, FavoritesSQL, likes)
+
+            tweet_ids = [int(like.tweet_id) for like in likes]
+            if tweet_ids:
+                if state.oldest_id:
+                    tweet_ids.append(int(state.oldest_id))
+                state.oldest_id = str(min(tweet_ids))
+            self._mark_synced(session, FavoritesSQL)
             session.commit()
 
-        return join_id
+    def _sync_relationships(self, model, kind, method, max_pages=None):
+        '''
+        Refresh friend or follower ids one cursor page at a time.
+        Each page is staged and committed along with the next cursor,
+        so an interrupted refresh resumes where it stopped.
+        With max_pages, stop after that many pages and return None
+        if the refresh is not complete yet.
+        '''
+        resource = model.__tablename__
 
-    def _remove_temp_join(self, join_id):
         with self._session() as session:
-            session.query(UserTempJoinSQL).filter(
-                UserTempJoinSQL.join_id == join_id
-            ).delete(synchronize_session='fetch')
+            state = self._get_sync_state(session, resource)
+            next_cursor = int(state.next_cursor) if state.next_cursor else -1
+
+            if next_cursor == -1:
+                # Nothing to resume, drop anything left by an abandoned refresh.
+                session.query(RelationshipStagingSQL).filter(
+                    RelationshipStagingSQL.kind == kind
+                ).delete(synchronize_session=False)
+                session.commit()
+
+        # A cursor of 0 means every page was staged but not yet applied.
+        if next_cursor != 0:
+            pages = tweepy.Cursor(
+                method,
+                id=self._user_id,
+                cursor=next_cursor
+            ).pages()
+
+            for fetched, page in enumerate(pages, start=1):
+                with self._session() as session:
+                    bulk_upsert(
+                        session,
+                        RelationshipStagingSQL,
+                        ({'kind': kind, 'user_id': str(user_id)}
+                         for user_id in page)
+                    )
+                    self._get_sync_state(
+                        session,
+                        resource
+                    ).next_cursor = str(pages.next_cursor)
+                    session.commit()
+
+                if max_pages is not None and fetched >= max_pages and pages.next_cursor != 0:
+                    return None
+
+        return self._apply_relationships(model, kind)
+
+    def _apply_relationships(self, model, kind):
+        '''
+        Replace the stored friend or follower ids with the staged ones by writing
+        only the difference. The difference is kept in relationship_changes
+        until the next refresh.
+        '''
+        if self._relationship_storage != BaquetConstants.STORAGE_TABLE:
+            return self._apply_packed_relationships(model, kind)
+        self._unpack_relationships(model)
+
+        now = datetime.utcnow()
+        staged = select(RelationshipStagingSQL.user_id).where(
+            RelationshipStagingSQL.kind == kind
+        )
+        stored = select(model.user_id)
+        added = and_(
+            RelationshipStagingSQL.kind == kind,
+            RelationshipStagingSQL.user_id.not_in(stored)
+        )
+        removed = model.user_id.not_in(staged)
+        change_columns = ['kind', 'user_id', 'added', 'last_updated']
+
+        with self._session() as session:
+            session.query(RelationshipChangesSQL).filter(
+                RelationshipChangesSQL.kind == kind
+            ).delete(synchronize_session=False)
+
+            # On the first refresh everything is new, which is not worth recording.
+            if session.query(stored.exists()).scalar():
+                session.execute(
+                    insert(RelationshipChangesSQL).from_select(
+                        change_columns,
+                        select(
+                            literal(kind),
+                            RelationshipStagingSQL.user_id,
+                            literal(True, Boolean),
+                            literal(now, DateTime)
+                        ).where(added)
+                    )
+                )
+                session.execute(
+                    insert(RelationshipChangesSQL).from_select(
+                        change_columns,
+                        select(
+                            literal(kind),
+                            model.user_id,
+                            literal(False, Boolean),
+                            literal(now, DateTime)
+                        ).where(removed)
+                    )
+                )
+
+            added_count = session.execute(
+                insert(model).from_select(
+                    ['user_id', 'last_updated'],
+                    select(
+                        RelationshipStagingSQL.user_id,
+                        literal(now, DateTime)
+                    ).where(added)
+                )
+            ).rowcount
+            removed_count = session.query(model).filter(
+                removed
+            ).delete(synchronize_session=False)
+
+            sketch = RelationshipSketch()
+            for user_ids in session.execute(staged).scalars().partitions(_SKETCH_BATCH_SIZE):
+                sketch.update([int(user_id) for user_id in user_ids])
+            self._save_sketch(session, model, sketch)
+
+            session.query(RelationshipStagingSQL).filter(
+                RelationshipStagingSQL.kind == kind
+            ).delete(synchronize_session=False)
+
+            state = self._get_sync_state(session, model.__tablename__)
+            state.next_cursor = None
+            self._mark_synced(
+                session,
+                model,
+                row_count=(
+                    state.row_count + added_count - removed_count
+                    if state.row_count is not None else None
+                )
+            )
             session.commit()
 
+        return added_count, removed_count
+
+    def _load_packed(self, model):
+        '''
+        The packed ids of the model, or None when they are kept in its table.
+        '''
+        path = find_packed(self._database, model.__tablename__)
+        return read_packed(path) if path else None
+
+    def _apply_packed_relationships(self, model, kind):
+        '''
+        Like _apply_relationships, but the staged ids replace a packed snapshot
+        and the model's table is emptied.
+        '''
+        now = datetime.utcnow()
+
+        with self._session() as session:
+            staged = to_ids(
+                user_id for user_id, in session.query(RelationshipStagingSQL.user_id).filter(
+                    RelationshipStagingSQL.kind == kind
+                )
+            )
+            stored = self._load_packed(model)
+            if stored is None:
+                stored = to_ids(user_id for user_id, in session.query(model.user_id))
+
+            added = difference(staged, stored)
+            removed = difference(stored, staged)
+
+            session.query(RelationshipChangesSQL).filter(
+                RelationshipChangesSQL.kind == kind
+            ).delete(synchronize_session=False)
+
+            # On the first refresh everything is new, which is not worth recording.
+            if stored.size:
+                bulk_upsert(
+                    session,
+                    RelationshipChangesSQL,
+                    [
+                        {'kind': kind, 'user_id': str(user_id), 'added': True, 'last_updated': now}
+                        for user_id in added.tolist()
+                    ] + [
+                        {'kind': kind, 'user_id': str(user_id), 'added': False, 'last_updated': now}
+                        for user_id in removed.tolist()
+                    ]
+                )
+
+            self._save_sketch(session, model, RelationshipSketch.from_ids(staged))
+
+            session.query(model).delete(synchronize_session=False)
+            session.query(RelationshipStagingSQL).filter(
+                RelationshipStagingSQL.kind == kind
+            ).delete(synchronize_session=False)
+
+            state = self._get_sync_state(session, model.__tablename__)
+            state.next_cursor = None
+            self._mark_synced(session, model, row_count=len(staged))
+
+            # The snapshot is swapped in only once the commit has succeeded.
+            pending = stage_packed(
+                self._database,
+                model.__tablename__,
+                staged,
+                compress=self._relationship_storage == BaquetConstants.STORAGE_PACKED_COMPRESSED
+            )
+            try:
+                session.commit()
+            except:
+                pending.unlink(missing_ok=True)
+                raise
+
+        # The old snapshot may be memory mapped, and a mapped file cannot be replaced on Windows.
+        del stored
+        swap_packed(pending)
+
+        return len(added), len(removed)
+
+    def _unpack_relationships(self, model):
+        '''
+        Move packed ids back into the model's table.
+        '''
+        packed = self._load_packed(model)
+        if packed is None:
+            return
+
+        now = datetime.utcnow()
+        with self._session() as session:
+            bulk_upsert(
+                session,
+                model,
+                ({'user_id': str(user_id), 'last_updated': now} for user_id in packed.tolist())
+            )
+            session.commit()
+
+        del packed
+        remove_packed(self._database, model.__tablename__)
+
+    def _save_sketch(self, session, model, sketch):
+        hll, minhash = sketch.to_bytes()
+        bulk_upsert(session, RelationshipSketchesSQL, [{
+            'resource': model.__tablename__,
+            'hll': hll,
+            'minhash': minhash,
+            'last_updated': datetime.utcnow(),
+        }])
+
+    def _get_sketch(self, model):
+        '''
+        Load the sketch of the model's ids. Relationships stored
+        before sketches existed are sketched on first use.
+        '''
+        with self._session() as session:
+            stored = session.query(RelationshipSketchesSQL).filter(
+                RelationshipSketchesSQL.resource == model.__tablename__
+            ).first()
+            if stored:
+                return RelationshipSketch(stored.hll, stored.minhash)
+
+        _, ids = self._get_relationship_ids(model, None)
+        sketch = RelationshipSketch.from_ids(
+            ids if isinstance(ids, np.ndarray) else [int(user_id) for user_id in ids]
+        )
+        with self._session() as session:
+            self._save_sketch(session, model, sketch)
+            session.commit()
+        return sketch
+
+    def _get_relationship_changes(self, kind, added, page, page_size):
+        with self._session() as session:
+            results = paginate(
+                session.query(RelationshipChangesSQL).filter(
+                    and_(
+                        RelationshipChangesSQL.kind == kind,
+                        RelationshipChangesSQL.added == added
+                    )
+                ),
+                page=page,
+                page_size=page_size
+            )
+            return load_model(results, RelationshipPaginatorModel)
+
+    def _get_row_count(self, session, model):
+        row_count = session.query(SyncStateSQL.row_count).filter(
+            SyncStateSQL.resource == model.__tablename__
+        ).scalar()
+        return (
+            row_count if row_count is not None else
+            session.query(func.count()).select_from(model).scalar()
+        )
+
+    def _relationship_query(self, session, model, ids=None):
+        query = session.query(model)
+        if ids is not None:
+            query = query.join(ids, model.user_id == ids.c.value)
+        return query
+
+    def _filter_packed(self, packed, watchlist):
+        if watchlist is None:
+            return packed
+        return intersect(packed, get_watchlist_ids(watchlist))
+
+    def _packed_items(self, model, ids):
+        return [model(user_id=str(user_id)) for user_id in ids.tolist()]
+
+    def _relationship_watchlist_counts(self, model, watchlist):
+        '''
+        Count (on the watchlist, all, watchlist members) for friends or followers.
+        '''
+        packed = self._load_packed(model)
+        if packed is not None:
+            watchlist_ids = get_watchlist_ids(watchlist)
+            return count_common(packed, watchlist_ids), len(packed), len(watchlist_ids)
+
+        with self._watchlist_session(watchlist) as (session, ids):
+            return tuple(session.execute(
+                select(
+                    _count_on_watchlist(model.user_id, ids),
+                    _count(model),
+                    _count(ids),
+                )
+            ).one())
+
+    def _get_relationships(self, model, page, page_size, watchlist):
+        packed = self._load_packed(model)
+        if packed is not None:
+            packed = self._filter_packed(packed, watchlist)
+            start = (page - 1) * page_size
+            results = Page(
+                self._packed_items(model, packed[start:start + page_size]),
+                page,
+                page_size,
+                len(packed)
+            )
+            if watchlist is not None:
+                results.items = self._hydrate_relationships(results.items)
+            return load_model(results, RelationshipPaginatorModel)
+
+        with self._watchlist_session(watchlist) as (session, ids):
+            results = paginate(
+                self._relationship_query(session, model, ids),
+                page=page,
+                page_size=page_size
+            )
+
+        if ids is not None:
+            results.items = self._hydrate_relationships(results.items)
+
+        return load_model(results, RelationshipPaginatorModel)
+
+    def _get_relationships_cursor(self, model, cursor, page_size, watchlist, include_total):
+        packed = self._load_packed(model)
+        if packed is not None:
+            packed = self._filter_packed(packed, watchlist)
+            start = (
+                int(packed.searchsorted(int(decode_cursor(cursor, (model.user_id,))[0]), 'right'))
+                if cursor else 0
+            )
+            items = self._packed_items(model, packed[start:start + page_size])
+            results = KeysetPage(
+                items,
+                encode_cursor([items[-1].user_id])
+                if start + page_size < len(packed) else None,
+                len(packed) if include_total else None
+            )
+            if watchlist is not None:
+                results.items = self._hydrate_relationships(results.items)
+            return load_model(results, RelationshipCursorPaginatorModel)
+
+        with self._watchlist_session(watchlist) as (session, ids):
+            query = self._relationship_query(session, model, ids)
+            results = keyset_paginate(
+                query,
+                (model.user_id,),
+                cursor=cursor,
+                page_size=page_size,
+                total=(
+                    (query.count() if ids is not None else self._get_row_count(session, model))
+                    if include_total else None
+                )
+            )
+
+        if ids is not None:
+            results.items = self._hydrate_relationships(results.items)
+
+        return load_model(results, RelationshipCursorPaginatorModel)
+
+    def _iter_relationships(self, model, watchlist, batch_size):
+        packed = self._load_packed(model)
+        if packed is not None:
+            packed = self._filter_packed(packed, watchlist)
+            for start in range(0, len(packed), batch_size):
+                for user_id in packed[start:start + batch_size].tolist():
+                    yield BaseRelationshipModel(user_id=str(user_id))
+            return
+
+        with self._watchlist_session(watchlist, stream=True) as (session, ids):
+            query = session.query(model.user_id, model.last_updated)
+            if ids is not None:
+                query = query.join(ids, model.user_id == ids.c.value)
+            yield from stream_models(session, query, BaseRelationshipModel, batch_size)
+
+    def _get_relationship_ids(self, model, version):
+        '''
+        Packed ids are returned as their sorted int64 array.
+        '''
+        with self._session() as session:
+            state = session.query(
+                SyncStateSQL.last_updated,
+                SyncStateSQL.row_count
+            ).filter(
+                SyncStateSQL.resource == model.__tablename__
+            ).first()
+            current = tuple(state) if state else None
+
+            if version is not None and version == current:
+                return current, None
+
+            packed = self._load_packed(model)
+            if packed is not None:
+                return current, packed
+            return current, [user_id for user_id, in session.query(model.user_id)]
+
+    def _hydrate_relationships(self, items):
+        '''
+        Attach the user details to each relationship.
+        '''
+        if items:
+            hydrated_results = hydrate_user_identifiers(
+                user_ids=[item.user_id for item in items])
+        else:
+            hydrated_results = []
+
+        new_items = []
+        for item in items:
+            for result in hydrated_results:
+                if item.user_id == result.user_id:
+                    setattr(item, "user", result)
+                    new_items.append(item)
+        return new_items
+
+    def _search_query(self, session, model, query, include_entities=True):
+        fts = table(f'{model.__tablename__}_fts', column('rowid'), column('rank'))
+        require_search_index(session, fts.name)
+        return session.query(*row_columns(model, include_entities)).join(
+            fts,
+            fts.c.rowid == literal_column(f'{model.__tablename__}.rowid')
+        ).filter(
+            literal_column(fts.name).match(query)
+        ).order_by(fts.c.rank)
+
+    # USER
+
     def _fetch_user(self):
-        user = _API.get_user(user_id=self._user_id)
+        user = get_api().get_user(user_id=self._user_id)
 
         if user:
-            _DIRECTORY.add_directory(user)
+            get_directory().add_directory(user)
             user_sql = transform_user(user, kind=BaquetConstants.USER)
 
             with self._session() as session:
-                session.merge(user_sql)
+                bulk_upsert(session, UsersSQL, [user_sql])
+                self._mark_synced(session, UsersSQL)
                 session.commit()
 
     def add_note_user(self, text):
@@ -148,7 +915,7 @@ class User:
             # Clear all to remove deletions
             session.query(ListMembershipsSQL).delete()
 
-            list_memberships = _API.lists_memberships(user_id=self._user_id)
+            list_memberships = get_api().lists_memberships(user_id=self._user_id)
 
             for membership in list_memberships:
                 list_membership = ListMembershipsSQL(
@@ -157,6 +924,7 @@ class User:
                     last_updated=datetime.utcnow()
                 )
                 session.merge(list_membership)
+            self._mark_synced(session, ListMembershipsSQL)
             session.commit()
 
     def get_list_memberships(self):
@@ -184,20 +952,18 @@ class User:
 
             return load_model(results, NotePaginatorModel)
 
-    def get_user(self):
+    def get_user(self, include_entities=True):
         '''
-        Get the user as an ORM object.
+        Get the user.
         If cache is expired, fetch first.
         '''
         if self._cache_expired(UsersSQL):
             self._fetch_user()
 
         with self._session() as session:
-            result = serialize_entities(
-                session.query(UsersSQL).filter(
-                    UsersSQL.user_id == self._user_id
-                ).first()
-            )
+            result = session.query(*row_columns(UsersSQL, include_entities)).filter(
+                UsersSQL.user_id == self._user_id
+            ).first()
 
             return load_model(result, UserModel)
 
@@ -220,19 +986,79 @@ class User:
                 session.delete(note)
                 session.commit()
 
+    def rebuild_search_index(self):
+        '''
+        Rebuild the timeline and favorites full-text indexes from their tables.
+        Needed if the database was VACUUMed, which can renumber rows,
+        or migrated by a SQLite without FTS5, which left the indexes out.
+        '''
+        rebuild_search_index(self._engine)
+
+    def watchlist_report(self, watchlist):
+        '''
+        Get the retweet, favorite, friends and followers watchlist percents
+        and completions, along with the counts behind them, in one pass.
+        If any cache is expired, fetch it first.
+        '''
+        for table, fetch in (
+                (TimelineSQL, self._fetch_timeline),
+                (FavoritesSQL, self._fetch_favorites),
+                (FriendsSQL, self._fetch_friends),
+                (FollowersSQL, self._fetch_followers),
+        ):
+            if self._cache_expired(table):
+                fetch()
+
+        with self._watchlist_session(watchlist) as (session, ids):
+            return make_watchlist_report(
+                session,
+                ids,
+                self._user_id,
+                packed=load_packed_relationships(self._database)
+            )
+
+    def _sketch_of(self, other, kind):
+        if isinstance(other, User):
+            return {
+                BaquetConstants.FRIENDS: other.get_friends_sketch,
+                BaquetConstants.FOLLOWERS: other.get_followers_sketch,
+            }[kind]()
+        return RelationshipSketch.from_ids(get_watchlist_ids(other))
+
+    def estimate_overlap(self, other, kind=BaquetConstants.FOLLOWERS):
+        '''
+        Estimate how many friends or followers this user shares with another User,
+        or how many are on a Watchlist or list of user ids, from sketches.
+        '''
+        return self._sketch_of(self, kind).overlap(self._sketch_of(other, kind))
+
+    def estimate_similarity(self, other, kind=BaquetConstants.FOLLOWERS):
+        '''
+        Estimate the Jaccard similarity of this user's friends or followers
+        and another User's, or a Watchlist or list of user ids, from sketches.
+        '''
+        return self._sketch_of(self, kind).jaccard(self._sketch_of(other, kind))
+
     # TIMELINE
 
-    def _fetch_timeline(self):
-        with self._session() as session:
-            for tweet in tweepy.Cursor(
-                    _API.user_timeline,
-                    id=self._user_id,
-                    tweet_mode="extended"
-            ).items(self._limit):
-                session.merge(
-                    transform_tweet(tweet, kind=BaquetConstants.TIMELINE)
+    def _fetch_timeline(self, backfill=False):
+        self._fetch_tweets(get_api().user_timeline, backfill=backfill)
+
+    def _timeline_query(self, session, ids=None, watchwords=None, include_entities=True):
+        query = session.query(*row_columns(TimelineSQL, include_entities))
+        if ids is not None:
+            query = query.join(
+                ids,
+                or_(
+                    TimelineSQL.retweet_user_id == ids.c.value,
+                    TimelineSQL.user_id == ids.c.value
                 )
-                session.commit()
+            )
+        if watchwords:
+            query = query.filter(
+                filter_by_watchwords(TimelineSQL.text, watchwords)
+            )
+        return query
 
     def add_note_timeline(self, tweet_id, text):
         '''
@@ -247,6 +1073,12 @@ class User:
             session.add(note)
             session.commit()
 
+    def backfill_timeline(self):
+        '''
+        Fetch up to `limit` tweets older than the oldest one stored.
+        '''
+        self._fetch_timeline(backfill=True)
+
     def add_tag_timeline(self, tweet_id, tag_text):
         '''
         Applies a tag to a given tweet.
@@ -277,24 +1109,15 @@ class User:
         if self._cache_expired(TimelineSQL):
             self._fetch_timeline()
 
-        watchlist = get_watchlist(watchlist, kind=BaquetConstants.WATCHLIST)
-
-        join_id = self._add_temp_join(watchlist)
-        with self._session() as session:
+        with self._watchlist_session(watchlist) as (session, ids):
 
             retweets_on_watchlist = session.query(TimelineSQL).join(
-                UserTempJoinSQL,
-                and_(
-                    TimelineSQL.retweet_user_id == UserTempJoinSQL.join_on,
-                    UserTempJoinSQL.join_id == join_id
-                )
+                ids, TimelineSQL.retweet_user_id == ids.c.value
             ).count()
             retweets = session.query(TimelineSQL).filter(
                 TimelineSQL.retweet_user_id != None  # pylint: disable=singleton-comparison
             ).count()
 
-        self._remove_temp_join(join_id)
-
         return retweets_on_watchlist / retweets if retweets != 0 else 0
 
     def get_tags_timeline(self, tweet_id):
@@ -308,7 +1131,14 @@ class User:
 
             return load_model(results, TagModel, many=True)
 
-    def get_timeline(self, page, page_size=20, watchlist=None, watchwords=None):
+    def get_timeline(
+            self,
+            page,
+            page_size=20,
+            watchlist=None,
+            watchwords=None,
+            include_entities=True
+    ):
         '''
             Get Tweets and Retweets from a user's timeline.
             If the cache is expired,
@@ -316,60 +1146,93 @@ class User:
         if self._cache_expired(TimelineSQL):
             self._fetch_timeline()
 
-        with self._session() as session:
-            if watchlist:
-                watchlist = get_watchlist(
-                    watchlist,
-                    kind=BaquetConstants.WATCHLIST
-                )
+        # When filtering, we are not interested in Tweets authored by the user.
+        with self._watchlist_session(watchlist, exclude_self=True) as (session, ids):
+            results = paginate(
+                self._timeline_query(session, ids, watchwords, include_entities).order_by(
+                    desc(TimelineSQL.created_at)
+                ),
+                page=page,
+                page_size=page_size
+            )
 
-                # When filtering, we are not interested in Tweets authored by the user.
-                if self._user_id in watchlist:
-                    watchlist.remove(self._user_id)
-
-                join_id = self._add_temp_join(watchlist)
-
-                results = paginate(
-                    session.query(TimelineSQL).join(
-                        UserTempJoinSQL,
-                        and_(
-                            or_(
-                                TimelineSQL.retweet_user_id == UserTempJoinSQL.join_on,
-                                TimelineSQL.user_id == UserTempJoinSQL.join_on
-                            ),
-                            UserTempJoinSQL.join_id == join_id
-                        )
-                    ).order_by(desc(TimelineSQL.created_at)),
-                    page=page,
-                    page_size=page_size
-                )
-            else:
-                results = paginate(
-                    session.query(TimelineSQL).order_by(
-                        desc(TimelineSQL.created_at)
-                    ),
-                    page=page,
-                    page_size=page_size
+            results = load_model(results, TweetPaginatorModel)
+            if watchwords:
+                set_matched_watchwords(results.items, watchwords)
+            return results
+
+    def get_timeline_cursor(
+            self,
+            cursor=None,
+            page_size=20,
+            watchlist=None,
+            watchwords=None,
+            include_total=False,
+            include_entities=True
+    ):
+        '''
+        Get Tweets and Retweets from a user's timeline, newest first.
+        Pages are walked with the returned next_cursor instead of a page number,
+        so deep pages are as fast as the first. Counting is opt-in.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(TimelineSQL):
+            self._fetch_timeline()
+
+        # When filtering, we are not interested in Tweets authored by the user.
+        with self._watchlist_session(watchlist, exclude_self=True) as (session, ids):
+            query = self._timeline_query(session, ids, watchwords, include_entities)
+            results = keyset_paginate(
+                query,
+                (TimelineSQL.created_at, TimelineSQL.tweet_id),
+                cursor=cursor,
+                page_size=page_size,
+                descending=True,
+                total=(
+                    (query.count() if ids is not None or watchwords else
+                     self._get_row_count(session, TimelineSQL))
+                    if include_total else None
                 )
+            )
 
+            results = load_model(results, TweetCursorPaginatorModel)
             if watchwords:
-                watchwords = get_watchlist(
-                    watchwords, kind=BaquetConstants.WATCHWORDS)
-                results.items = filter_for_watchwords(
-                    results.items, watchwords)
-
-            results = serialize_paginated_entities(results)
-            if watchlist:
-                self._remove_temp_join(join_id)
-            return load_model(results, TweetPaginatorModel)
+                set_matched_watchwords(results.items, watchwords)
+            return results
+
+    def iter_timeline(
+            self,
+            watchlist=None,
+            watchwords=None,
+            include_entities=True,
+            batch_size=BaquetConstants.STREAM_BATCH_SIZE
+    ):
+        '''
+        Stream all the Tweets and Retweets from a user's timeline, newest first, in one pass.
+        Takes the filters of get_timeline, reads batch_size rows at a time.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(TimelineSQL):
+            self._fetch_timeline()
 
-    def get_timeline_tagged(self, tag_id, page, page_size=20):
+        with self._watchlist_session(watchlist, exclude_self=True, stream=True) as (session, ids):
+            yield from stream_models(
+                session,
+                self._timeline_query(session, ids, watchwords, include_entities).order_by(
+                    desc(TimelineSQL.created_at)
+                ),
+                TweetModel,
+                batch_size,
+                watchwords
+            )
+
+    def get_timeline_tagged(self, tag_id, page, page_size=20, include_entities=True):
         '''
         Get the tweets matching a particular tag.
         '''
         with self._session() as session:
             results = paginate(
-                session.query(TimelineSQL).join(
+                session.query(*row_columns(TimelineSQL, include_entities)).join(
                     TimelineTagsSQL,
                     TimelineSQL.tweet_id == TimelineTagsSQL.tweet_id
                 ).filter(
@@ -379,7 +1242,6 @@ class User:
                 page_size=page_size
             )
 
-        results = serialize_paginated_entities(results)
         return load_model(results, TweetPaginatorModel)
 
     def remove_note_timeline(self, tweet_id, note_id):
@@ -404,19 +1266,38 @@ class User:
             session.delete(tag_id)
             session.commit()
 
+    def search_timeline(self, query, page, page_size=20, include_entities=True):
+        '''
+        Full-text search of Tweets and Retweets, best matches first.
+        Takes SQLite FTS5 queries: "a phrase", prefix*, AND, OR, NOT.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(TimelineSQL):
+            self._fetch_timeline()
+
+        with self._session() as session, search_query_errors(query):
+            results = paginate(
+                self._search_query(session, TimelineSQL, query, include_entities),
+                page=page,
+                page_size=page_size
+            )
+
+            return load_model(results, TweetPaginatorModel)
+
     # FAVORITES
 
-    def _fetch_favorites(self):
-        with self._session() as session:
-            for favorite in tweepy.Cursor(
-                    _API.favorites, id=self._user_id, tweet_mode="extended").items(self._limit):
-                session.merge(
-                    transform_tweet(
-                        favorite,
-                        kind=BaquetConstants.FAVORITE
-                    )
-                )
-            session.commit()
+    def _fetch_favorites(self, backfill=False):
+        self._fetch_likes(get_api().favorites, backfill=backfill)
+
+    def _favorites_query(self, session, ids=None, watchwords=None, include_entities=True):
+        query = session.query(*row_columns(FavoritesSQL, include_entities))
+        if ids is not None:
+            query = query.join(ids, FavoritesSQL.user_id == ids.c.value)
+        if watchwords:
+            query = query.filter(
+                filter_by_watchwords(FavoritesSQL.text, watchwords)
+            )
+        return query
 
     def add_note_favorite(self, tweet_id, text):
         '''
@@ -428,6 +1309,15 @@ class User:
             session.add(note)
             session.commit()
 
+    def backfill_favorites(self):
+        '''
+        Fetch up to `limit` likes of tweets older than the oldest one stored.
+        The endpoint pages by tweet id, not by when the tweet was liked, so a like
+        of a tweet newer than the oldest stored one that fell out of the recent
+        likes is never fetched.
+        '''
+        self._fetch_favorites(backfill=True)
+
     def add_tag_favorite(self, tweet_id, tag_text):
         '''
         Applies a tag to a given tweet.
@@ -446,25 +1336,23 @@ class User:
         if self._cache_expired(FavoritesSQL):
             self._fetch_favorites()
 
-        watchlist = get_watchlist(watchlist, kind=BaquetConstants.WATCHLIST)
-
-        join_id = self._add_temp_join(watchlist)
-        with self._session() as session:
+        with self._watchlist_session(watchlist) as (session, ids):
 
             favorites_on_watchlist = session.query(FavoritesSQL).join(
-                UserTempJoinSQL,
-                and_(
-                    FavoritesSQL.user_id == UserTempJoinSQL.join_on,
-                    UserTempJoinSQL.join_id == join_id
-                )
+                ids, FavoritesSQL.user_id == ids.c.value
             ).count()
             favorites = session.query(FavoritesSQL).count()
 
-        self._remove_temp_join(join_id)
-
         return favorites_on_watchlist / favorites if favorites != 0 else 0
 
-    def get_favorites(self, page, page_size=20, watchlist=None, watchwords=None):
+    def get_favorites(
+            self,
+            page,
+            page_size=20,
+            watchlist=None,
+            watchwords=None,
+            include_entities=True
+    ):
         '''
         Get the posts a user has liked.
         If cache is expired, fetch them.
@@ -472,54 +1360,91 @@ class User:
         if self._cache_expired(FavoritesSQL):
             self._fetch_favorites()
 
-        with self._session() as session:
-            if watchlist:
-                watchlist = get_watchlist(
-                    watchlist,
-                    kind=BaquetConstants.WATCHLIST
-                )
+        with self._watchlist_session(watchlist) as (session, ids):
+            results = paginate(
+                self._favorites_query(session, ids, watchwords, include_entities).order_by(
+                    desc(FavoritesSQL.created_at)
+                ),
+                page=page,
+                page_size=page_size
+            )
 
-                join_id = self._add_temp_join(watchlist)
-
-                results = paginate(
-                    session.query(FavoritesSQL).join(
-                        UserTempJoinSQL,
-                        and_(
-                            FavoritesSQL.user_id == UserTempJoinSQL.join_on,
-                            UserTempJoinSQL.join_id == join_id
-                        )
-                    ).order_by(desc(FavoritesSQL.created_at)),
-                    page=page,
-                    page_size=page_size
-                )
-            else:
-                results = paginate(
-                    session.query(FavoritesSQL).order_by(
-                        desc(FavoritesSQL.created_at)
-                    ),
-                    page=page,
-                    page_size=page_size
+            results = load_model(results, TweetPaginatorModel)
+            if watchwords:
+                set_matched_watchwords(results.items, watchwords)
+            return results
+
+    def get_favorites_cursor(
+            self,
+            cursor=None,
+            page_size=20,
+            watchlist=None,
+            watchwords=None,
+            include_total=False,
+            include_entities=True
+    ):
+        '''
+        Get the posts a user has liked, newest first.
+        Pages are walked with the returned next_cursor instead of a page number,
+        so deep pages are as fast as the first. Counting is opt-in.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(FavoritesSQL):
+            self._fetch_favorites()
+
+        with self._watchlist_session(watchlist) as (session, ids):
+            query = self._favorites_query(session, ids, watchwords, include_entities)
+            results = keyset_paginate(
+                query,
+                (FavoritesSQL.created_at, FavoritesSQL.tweet_id),
+                cursor=cursor,
+                page_size=page_size,
+                descending=True,
+                total=(
+                    (query.count() if ids is not None or watchwords else
+                     self._get_row_count(session, FavoritesSQL))
+                    if include_total else None
                 )
+            )
 
+            results = load_model(results, TweetCursorPaginatorModel)
             if watchwords:
-                watchwords = get_watchlist(
-                    watchwords, kind=BaquetConstants.WATCHWORDS)
-                results.items = filter_for_watchwords(
-                    results.items, watchwords)
-
-            # This maneuver seems to be required for sqlalchemy...
-            results = serialize_paginated_entities(results)
-            if watchlist:
-                self._remove_temp_join(join_id)
-            return load_model(results, TweetPaginatorModel)
+                set_matched_watchwords(results.items, watchwords)
+            return results
+
+    def iter_favorites(
+            self,
+            watchlist=None,
+            watchwords=None,
+            include_entities=True,
+            batch_size=BaquetConstants.STREAM_BATCH_SIZE
+    ):
+        '''
+        Stream all the posts a user has liked, newest first, in one pass.
+        Takes the filters of get_favorites, reads batch_size rows at a time.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(FavoritesSQL):
+            self._fetch_favorites()
 
-    def get_favorites_tagged(self, tag_id, page, page_size=20):
+        with self._watchlist_session(watchlist, stream=True) as (session, ids):
+            yield from stream_models(
+                session,
+                self._favorites_query(session, ids, watchwords, include_entities).order_by(
+                    desc(FavoritesSQL.created_at)
+                ),
+                TweetModel,
+                batch_size,
+                watchwords
+            )
+
+    def get_favorites_tagged(self, tag_id, page, page_size=20, include_entities=True):
         '''
         Get the tweets matching a particular tag.
         '''
         with self._session() as session:
             results = paginate(
-                session.query(FavoritesSQL).join(
+                session.query(*row_columns(FavoritesSQL, include_entities)).join(
                     FavoritesTagsSQL, FavoritesSQL.tweet_id == FavoritesTagsSQL.tweet_id
                 ).filter(
                     FavoritesTagsSQL.tag_id == tag_id
@@ -528,7 +1453,6 @@ class User:
                 page_size=page_size
             )
 
-        results = serialize_paginated_entities(results)
         return load_model(results, TweetPaginatorModel)
 
     def get_notes_favorite(self, tweet_id):
@@ -578,24 +1502,33 @@ class User:
             ).delete(synchronize_session='fetch')
             session.commit()
 
-    # FRIENDS
+    def search_favorites(self, query, page, page_size=20, include_entities=True):
+        '''
+        Full-text search of liked posts, best matches first.
+        Takes SQLite FTS5 queries: "a phrase", prefix*, AND, OR, NOT.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(FavoritesSQL):
+            self._fetch_favorites()
 
-    def _fetch_friends(self):
-        # Delete to prevent stale entries.
-        with self._session() as session:
-            session.query(FriendsSQL).delete()
+        with self._session() as session, search_query_errors(query):
+            results = paginate(
+                self._search_query(session, FavoritesSQL, query, include_entities),
+                page=page,
+                page_size=page_size
+            )
 
-            friends = []
-            for friend_id in tweepy.Cursor(_API.friends_ids, id=self._user_id).items():
-                session.merge(
-                    FriendsSQL(
-                        user_id=friend_id,
-                        last_updated=datetime.utcnow()
-                    )
-                )
+            return load_model(results, TweetPaginatorModel)
 
-            session.bulk_save_objects(friends)
-            session.commit()
+    # FRIENDS
+
+    def _fetch_friends(self, max_pages=None):
+        return self._sync_relationships(
+            FriendsSQL,
+            BaquetConstants.FRIENDS,
+            get_api().friends_ids,
+            max_pages=max_pages
+        )
 
     def get_friends(self, page, page_size=100, watchlist=None):
         '''
@@ -605,75 +1538,76 @@ class User:
         if self._cache_expired(FriendsSQL):
             self._fetch_friends()
 
-        if watchlist:
-            watchlist = get_watchlist(
-                watchlist, kind=BaquetConstants.WATCHLIST)
-            join_id = self._add_temp_join(watchlist)
-            with self._session() as session:
+        return self._get_relationships(FriendsSQL, page, page_size, watchlist)
 
-                results = paginate(
-                    session.query(FriendsSQL).join(
-                        UserTempJoinSQL,
-                        and_(
-                            FriendsSQL.user_id == UserTempJoinSQL.join_on,
-                            UserTempJoinSQL.join_id == join_id
-                        )
-                    ),
-                    page=page,
-                    page_size=page_size
-                )
+    def get_friends_cursor(self, cursor=None, page_size=100, watchlist=None, include_total=False):
+        '''
+        Like get_friends, but paged by cursor in user id order.
+        Pass the returned next_cursor to get the following page.
+        Counting is opt-in.
+        '''
+        if self._cache_expired(FriendsSQL):
+            self._fetch_friends()
 
-            self._remove_temp_join(join_id)
+        return self._get_relationships_cursor(
+            FriendsSQL, cursor, page_size, watchlist, include_total)
 
-            if results.items:
-                hydrated_results = hydrate_user_identifiers(
-                    user_ids=[result.user_id for result in results.items])
-            else:
-                hydrated_results = []
+    def iter_friends(self, watchlist=None, batch_size=BaquetConstants.STREAM_BATCH_SIZE):
+        '''
+        Stream all the users this user is following, in one pass, without user details.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(FriendsSQL):
+            self._fetch_friends()
 
-            new_items = []
-            for item in results.items:
-                for result in hydrated_results:
-                    if item.user_id == result.user_id:
-                        setattr(item, "user", result)
-                        new_items.append(item)
-            results.items = new_items
+        yield from self._iter_relationships(FriendsSQL, watchlist, batch_size)
 
-            return load_model(results, RelationshipPaginatorModel)
+    def get_friends_ids(self, version=None):
+        '''
+        Get the ids of every friend as (version, ids).
+        Pass back a version to skip reloading unchanged ids, which are then None.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(FriendsSQL):
+            self._fetch_friends()
 
-        with self._session() as session:
-            results = paginate(
-                session.query(FriendsSQL),
-                page=page,
-                page_size=page_size
-            )
-            return load_model(results, RelationshipPaginatorModel)
+        return self._get_relationship_ids(FriendsSQL, version)
 
-    def get_friends_watchlist_completion(self, watchlist):
+    def get_friends_sketch(self):
         '''
-        Get percentage completion of watchlist,
-        based on friends on the watchlist.
+        Get the HyperLogLog and MinHash sketch of the friends.
+        If cache is expired, fetch them.
         '''
         if self._cache_expired(FriendsSQL):
             self._fetch_friends()
 
-        watchlist = get_watchlist(watchlist, kind=BaquetConstants.WATCHLIST)
-        join_id = self._add_temp_join(watchlist)
+        return self._get_sketch(FriendsSQL)
 
-        with self._session() as session:
+    def get_friends_changes(self, page, page_size=100, added=True):
+        '''
+        Get the users this user started following in the last refresh,
+        or stopped following when added is False.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(FriendsSQL):
+            self._fetch_friends()
 
-            friends_on_watchlist = session.query(FriendsSQL).join(
-                UserTempJoinSQL,
-                and_(
-                    FriendsSQL.user_id == UserTempJoinSQL.join_on,
-                    UserTempJoinSQL.join_id == join_id
-                )
-            ).count()
+        return self._get_relationship_changes(
+            BaquetConstants.FRIENDS, added, page, page_size)
 
-        self._remove_temp_join(join_id)
+    def get_friends_watchlist_completion(self, watchlist):
+        '''
+        Get percentage completion of watchlist,
+        based on friends on the watchlist.
+        '''
+        if self._cache_expired(FriendsSQL):
+            self._fetch_friends()
 
-        return (friends_on_watchlist / len(watchlist)
-                if watchlist else 0)
+        friends_on_watchlist, _, watchlist_size = self._relationship_watchlist_counts(
+            FriendsSQL, watchlist)
+
+        return (friends_on_watchlist / watchlist_size
+                if watchlist_size else 0)
 
     def get_friends_watchlist_percent(self, watchlist):
         '''
@@ -682,42 +1616,20 @@ class User:
         if self._cache_expired(FriendsSQL):
             self._fetch_friends()
 
-        watchlist = get_watchlist(watchlist, kind=BaquetConstants.WATCHLIST)
-        join_id = self._add_temp_join(watchlist)
-
-        with self._session() as session:
-
-            friends_on_watchlist = session.query(FriendsSQL).join(
-                UserTempJoinSQL,
-                and_(
-                    FriendsSQL.user_id == UserTempJoinSQL.join_on,
-                    UserTempJoinSQL.join_id == join_id
-                )
-            ).count()
-            friends = session.query(FriendsSQL).count()
-
-        self._remove_temp_join(join_id)
+        friends_on_watchlist, friends, _ = self._relationship_watchlist_counts(
+            FriendsSQL, watchlist)
 
         return friends_on_watchlist / friends if friends != 0 else 0
 
     # FOLLOWERS
 
-    def _fetch_followers(self):
-        with self._session() as session:
-            # Delete to prevent stale entries.
-            session.query(FollowersSQL).delete()
-
-            followers = []
-            for follower_id in tweepy.Cursor(_API.followers_ids, id=self._user_id).items():
-                followers.append(
-                    FollowersSQL(
-                        user_id=follower_id,
-                        last_updated=datetime.utcnow()
-                    )
-                )
-
-            session.bulk_save_objects(followers)
-            session.commit()
+    def _fetch_followers(self, max_pages=None):
+        return self._sync_relationships(
+            FollowersSQL,
+            BaquetConstants.FOLLOWERS,
+            get_api().followers_ids,
+            max_pages=max_pages
+        )
 
     def get_followers(self, page, page_size=100, watchlist=None):
         '''
@@ -727,78 +1639,77 @@ class User:
         if self._cache_expired(FollowersSQL):
             self._fetch_followers()
 
-        if watchlist:
-            watchlist = get_watchlist(
-                watchlist, kind=BaquetConstants.WATCHLIST)
-
-            join_id = self._add_temp_join(watchlist)
+        return self._get_relationships(FollowersSQL, page, page_size, watchlist)
 
-            with self._session() as session:
+    def get_followers_cursor(self, cursor=None, page_size=100, watchlist=None, include_total=False):
+        '''
+        Like get_followers, but paged by cursor in user id order.
+        Pass the returned next_cursor to get the following page.
+        Counting is opt-in.
+        '''
+        if self._cache_expired(FollowersSQL):
+            self._fetch_followers()
 
-                results = paginate(
-                    session.query(FollowersSQL).join(
-                        UserTempJoinSQL,
-                        and_(
-                            FollowersSQL.user_id == UserTempJoinSQL.join_on,
-                            UserTempJoinSQL.join_id == join_id
-                        )
-                    ),
-                    page=page,
-                    page_size=page_size
-                )
+        return self._get_relationships_cursor(
+            FollowersSQL, cursor, page_size, watchlist, include_total)
 
-            self._remove_temp_join(join_id)
+    def iter_followers(self, watchlist=None, batch_size=BaquetConstants.STREAM_BATCH_SIZE):
+        '''
+        Stream all the users following this user, in one pass, without user details.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(FollowersSQL):
+            self._fetch_followers()
 
-            if results.items:
-                hydrated_results = hydrate_user_identifiers(
-                    user_ids=[result.user_id for result in results.items])
-            else:
-                hydrated_results = []
+        yield from self._iter_relationships(FollowersSQL, watchlist, batch_size)
 
-            new_items = []
-            for item in results.items:
-                for result in hydrated_results:
-                    if item.user_id == result.user_id:
-                        setattr(item, "user", result)
-                        new_items.append(item)
-            results.items = new_items
+    def get_followers_ids(self, version=None):
+        '''
+        Get the ids of every follower as (version, ids).
+        Pass back a version to skip reloading unchanged ids, which are then None.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(FollowersSQL):
+            self._fetch_followers()
 
-            return load_model(results, RelationshipPaginatorModel)
-        with self._session() as session:
-            results = paginate(
-                session.query(FollowersSQL),
-                page=page,
-                page_size=page_size
-            )
-            return load_model(results, RelationshipPaginatorModel)
+        return self._get_relationship_ids(FollowersSQL, version)
 
-    def get_followers_watchlist_completion(self, watchlist):
+    def get_followers_sketch(self):
         '''
-        Get percentage completion of watchlist,
-        based on followers on the watchlist.
+        Get the HyperLogLog and MinHash sketch of the followers.
+        If cache is expired, fetch them.
         '''
         if self._cache_expired(FollowersSQL):
             self._fetch_followers()
 
-        watchlist = get_watchlist(watchlist, kind=BaquetConstants.WATCHLIST)
+        return self._get_sketch(FollowersSQL)
 
-        join_id = self._add_temp_join(watchlist)
+    def get_followers_changes(self, page, page_size=100, added=True):
+        '''
+        Get the users who started following this user in the last refresh,
+        or stopped following when added is False.
+        If cache is expired, fetch them.
+        '''
+        if self._cache_expired(FollowersSQL):
+            self._fetch_followers()
 
-        with self._session() as session:
+        return self._get_relationship_changes(
+            BaquetConstants.FOLLOWERS, added, page, page_size)
 
-            followers_on_watchlist = session.query(FollowersSQL).join(
-                UserTempJoinSQL,
-                and_(
-                    FollowersSQL.user_id == UserTempJoinSQL.join_on,
-                    UserTempJoinSQL.join_id == join_id
-                )
-            ).count()
+    def get_followers_watchlist_completion(self, watchlist):
+        '''
+        Get percentage completion of watchlist,
+        based on followers on the watchlist.
+        '''
+        if self._cache_expired(FollowersSQL):
+            self._fetch_followers()
 
-        self._remove_temp_join(join_id)
+        followers_on_watchlist, _, watchlist_size = self._relationship_watchlist_counts(
+            FollowersSQL, watchlist)
 
         return (
-            followers_on_watchlist / len(watchlist)
-            if watchlist else
+            followers_on_watchlist / watchlist_size
+            if watchlist_size else
             0
         )
 
@@ -809,24 +1720,67 @@ class User:
         if self._cache_expired(FollowersSQL):
             self._fetch_followers()
 
-        watchlist = get_watchlist(watchlist, kind=BaquetConstants.WATCHLIST)
-
-        join_id = self._add_temp_join(watchlist)
+        followers_on_watchlist, followers, _ = self._relationship_watchlist_counts(
+            FollowersSQL, watchlist)
 
-        with self._session() as session:
+        return followers_on_watchlist / followers if followers != 0 else 0
 
-            followers_on_watchlist = session.query(FollowersSQL).join(
-                UserTempJoinSQL,
-                and_(
-                    FollowersSQL.user_id == UserTempJoinSQL.join_on,
-                    UserTempJoinSQL.join_id == join_id
-                )
-            ).count()
-            followers = session.query(FollowersSQL).count()
+    def estimate_followers_watchlist_percent(self, watchlist, max_pages=1, confidence=0.95):
+        '''
+        Estimate the percentage of followers that are on the watchlist without
+        waiting for every follower. Each call fetches up to max_pages more pages,
+        and the followers fetched so far are the sample. Pages come newest
+        followers first, so the sample is not random and the interval is a heuristic.
+        Once the fetch completes, or while the cache is fresh, the percent is exact.
+        '''
+        if self._cache_expired(FollowersSQL) and self._fetch_followers(max_pages=max_pages) is None:
+            with self._watchlist_session(watchlist) as (session, ids):
+                hits, sample_size = session.execute(
+                    select(
+                        _count_on_watchlist(
+                            RelationshipStagingSQL.user_id,
+                            ids,
+                            RelationshipStagingSQL.kind == BaquetConstants.FOLLOWERS
+                        ),
+                        _count(
+                            RelationshipStagingSQL,
+                            RelationshipStagingSQL.kind == BaquetConstants.FOLLOWERS
+                        ),
+                    )
+                ).one()
 
-        self._remove_temp_join(join_id)
+            if self._cache_expired(UsersSQL):
+                self._fetch_user()
+            with self._session() as session:
+                followers_count = session.query(UsersSQL.followers_count).filter(
+                    UsersSQL.user_id == self._user_id
+                ).scalar()
+
+            # The refresh is not complete, so the estimate is never exact,
+            # even when the sample has reached the possibly stale followers_count.
+            lower, upper = wilson_interval(hits, sample_size, confidence)
+            return WatchlistEstimateModel(
+                percent=_ratio(hits, sample_size),
+                lower=lower,
+                upper=upper,
+                confidence=confidence,
+                sample_size=sample_size,
+                population=max(followers_count or 0, sample_size),
+                exact=False,
+            )
 
-        return followers_on_watchlist / followers if followers != 0 else 0
+        followers_on_watchlist, followers, _ = self._relationship_watchlist_counts(
+            FollowersSQL, watchlist)
+        percent = _ratio(followers_on_watchlist, followers)
+        return WatchlistEstimateModel(
+            percent=percent,
+            lower=percent,
+            upper=percent,
+            confidence=confidence,
+            sample_size=followers,
+            population=followers,
+            exact=True,
+        )
 
     # TAGS
 
@@ -859,9 +1813,3 @@ class User:
             ).all()
 
             return load_model(results, TagModel, many=True)
-
-
-# GLOBALS
-_CONFIG = make_config()
-_API = make_api(_CONFIG)
-_DIRECTORY = Directory()
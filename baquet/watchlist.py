@@ -9,11 +9,13 @@ from datetime import datetime, timedelta
 
 import requests
 from sqlalchemy_pagination import paginate
-from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import create_engine, or_, and_, not_
+from sqlalchemy.orm import Session
+from sqlalchemy import or_, and_, not_, select, table, column
+from sqlalchemy.sql import func
 from .constants import BaquetConstants
+from .migrations import migrate
+from .engines import ENGINES
 from .sql.watchlist import (
-    BASE,
     WatchlistSQL,
     WatchwordsSQL,
     SubListSQL,
@@ -21,7 +23,10 @@ from .sql.watchlist import (
     UserSubListSQL,
 )
 from .helpers import (
-    serialize_paginated_entities,
+    get_api,
+    get_watchword_matcher,
+    row_columns,
+    stream_models,
     transform_user,
 )
 from .models import (
@@ -30,7 +35,23 @@ from .models import (
     SublistModel,
     UserModel
 )
-from .directory import hydrate_user_identifiers, _API
+from .directory import hydrate_user_identifiers
+
+
+def watchlist_members(schema=None):
+    '''
+    Select the distinct user ids on the watchlist, leaving out local exclusions.
+    Give the schema name to read a watchlist database attached to another connection.
+    '''
+    user_sublists = table(
+        UserSubListSQL.__tablename__,
+        column('user_id'),
+        column('locally_excluded'),
+        schema=schema
+    )
+    return select(user_sublists.c.user_id).where(
+        user_sublists.c.locally_excluded.isnot(True)
+    ).distinct()
 
 
 class Watchlist:
@@ -41,24 +62,20 @@ class Watchlist:
     def __init__(self, name, cache_expiry=604800):
         self._name = name
         self._cache_expiry = cache_expiry
+        self._database = Path(f'./watchlists/{self._name}.db')
         self._conn = self._make_conn()
 
     def _make_conn(self):
-        database = Path(f'./watchlists/{self._name}.db')
-        engine = create_engine(
-            f'sqlite:///{database}', connect_args={"check_same_thread": False})
-        session_factory = sessionmaker(
-            autocommit=False,
-            autoflush=False,
-            bind=engine
+        database = self._database
+        is_new = not database.exists()
+        database.parent.mkdir(parents=True, exist_ok=True)
+        self._engine, session = ENGINES.get(
+            database,
+            setup=lambda engine: migrate(engine, BaquetConstants.WATCHLIST),
+            owner=self
         )
 
-        session = scoped_session(session_factory)
-
-        if not database.exists():
-            database.parent.mkdir(parents=True, exist_ok=True)
-            BASE.metadata.create_all(engine)
-
+        if is_new:
             self._db_init(session)
 
         return session
@@ -105,8 +122,25 @@ class Watchlist:
         finally:
             session.close()
 
+    @contextmanager
+    def _stream_session(self):
+        '''
+        A session of its own, not the thread's scoped session,
+        so that calls made while a stream is read do not close it.
+        '''
+        session = Session(bind=self._engine, autoflush=False)
+        try:
+            yield session
+        finally:
+            session.close()
+
     # WATCHLIST
 
+    def _members_query(self, session, include_entities=True):
+        return session.query(*row_columns(WatchlistSQL, include_entities)).filter(
+            WatchlistSQL.user_id.in_(watchlist_members())
+        )
+
     def add_watchlist(self, users, sublist_id=BaquetConstants.SUBLIST_TYPE_SELF):
         '''
         Add one or more users to the watchlist.
@@ -142,37 +176,58 @@ class Watchlist:
         Remove all users from the watchlist.
         '''
         with self._session() as session:
+            session.query(UserSubListSQL).delete()
             session.query(WatchlistSQL).delete()
             session.commit()
 
     def get_watchlist(self):
         '''
-        Get the watchlist as a list of user ids.
+        Get the watchlist as a list of user ids, without local exclusions.
         '''
         with self._session() as session:
-            return [user.user_id for user in session.query(WatchlistSQL).all()]
+            return list(session.execute(watchlist_members()).scalars())
+
+    def get_database(self):
+        '''
+        Get the path of the watchlist's database file.
+        '''
+        return self._database
 
     def get_watchlist_count(self):
         '''
-        Get the count of users on the watchlist.
+        Get the count of users on the watchlist, without local exclusions.
         '''
         with self._session() as session:
-            return session.query(WatchlistSQL).count()
+            return session.execute(
+                select(func.count()).select_from(watchlist_members().subquery())
+            ).scalar()
 
-    def get_watchlist_users(self, page, page_size=20):
+    def get_watchlist_users(self, page, page_size=20, include_entities=True):
         '''
-        Get the watchlist as a list of Users with details.
+        Get the watchlist as a list of Users with details, without local exclusions.
         '''
         with self._session() as session:
             results = paginate(
-                session.query(WatchlistSQL),
+                self._members_query(session, include_entities),
                 page=page,
                 page_size=page_size,
             )
 
-            results = serialize_paginated_entities(results)
             return load_model(results, UserPaginatorModel)
 
+    def iter_users(self, include_entities=True, batch_size=BaquetConstants.STREAM_BATCH_SIZE):
+        '''
+        Stream the watchlist as Users with details, without local exclusions,
+        in one pass, reading batch_size rows at a time.
+        '''
+        with self._stream_session() as session:
+            yield from stream_models(
+                session,
+                self._members_query(session, include_entities),
+                UserModel,
+                batch_size
+            )
+
     def import_blockbot_list(self, blockbot_id, name):
         '''
         Import a theblockbot.com list.
@@ -199,7 +254,7 @@ class Watchlist:
         ), "Must supply twitter_id or both slug and owner_screen_name."
 
         # Get the twitter list data.
-        twitter_list = _API.get_list(
+        twitter_list = get_api().get_list(
             list_id=twitter_id,
             slug=slug,
             owner_screen_name=owner_screen_name
@@ -267,28 +322,29 @@ class Watchlist:
             results = session.query(SubListSQL).all()
             return load_model(results, SublistModel, many=True)
 
-    def get_sublist_users(self, sublist_id, page, page_size=20):
+    def get_sublist_users(self, sublist_id, page, page_size=20, include_entities=True):
         '''
         List the users that belong to a sublist.
         '''
         with self._session() as session:
             results = paginate(
-                session.query(WatchlistSQL).join(
+                session.query(*row_columns(WatchlistSQL, include_entities)).join(
                     UserSubListSQL
                 ).filter(UserSubListSQL.sublist_id == sublist_id),
                 page=page,
                 page_size=page_size,
             )
 
-            results = serialize_paginated_entities(results)
             return load_model(results, UserPaginatorModel)
 
-    def get_sublist_user_exclusions(self, sublist_id):
+    def get_sublist_user_exclusions(self, sublist_id, include_entities=True):
         '''
         List the users that are
         '''
         with self._session() as session:
-            results = session.query(WatchlistSQL).join(UserSubListSQL).filter(
+            results = session.query(
+                *row_columns(WatchlistSQL, include_entities)
+            ).join(UserSubListSQL).filter(
                 and_(
                     UserSubListSQL.sublist_id == sublist_id,
                     UserSubListSQL.locally_excluded
@@ -418,6 +474,12 @@ class Watchlist:
         with self._session() as session:
             return [ww.regex for ww in session.query(WatchwordsSQL.regex).all()]
 
+    def get_watchword_matcher(self):
+        '''
+        Get the watchwords compiled into a WatchwordMatcher.
+        '''
+        return get_watchword_matcher(self)
+
     def get_watchwords_count(self):
         '''
         Get the count of users on the watchwords.
@@ -0,0 +1,131 @@
+'''
+Compare rows/second of the per-row merge write path with bulk_upsert.
+
+Run from the repository root:
+    python -m benchmarks.bench_bulk_upsert [rows]
+'''
+
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from baquet.helpers import bulk_upsert
+from baquet.sql.user import BASE as USER_BASE, TimelineSQL
+from baquet.sql.directory import BASE as DIR_BASE, CacheSQL
+
+
+def make_tweets(count):
+    '''
+    Build timeline rows shaped like transform_tweet output.
+    '''
+    now = datetime.utcnow()
+    return [
+        TimelineSQL(
+            created_at=now - timedelta(minutes=i),
+            entities='{"hashtags": [], "urls": []}',
+            favorite_count=i,
+            tweet_id=str(1000000000000000000 + i),
+            is_quote_status=False,
+            lang='en',
+            possibly_sensitive=False,
+            retweet_count=i,
+            source='Twitter Web App',
+            source_url='https://mobile.twitter.com',
+            text=f'benchmark tweet number {i}',
+            retweet_user_id=None,
+            retweet_screen_name=None,
+            retweet_name=None,
+            user_id='12345',
+            screen_name='bench',
+            name='Bench',
+            last_updated=now,
+        ) for i in range(count)
+    ]
+
+
+def make_cache_users(count):
+    '''
+    Build cache rows shaped like transform_user output.
+    '''
+    now = datetime.utcnow()
+    return [
+        CacheSQL(
+            created_at=now,
+            description='benchmark user',
+            entities='{}',
+            favorites_count=i,
+            followers_count=i,
+            friends_count=i,
+            user_id=str(i),
+            name=f'User {i}',
+            screen_name=f'user_{i}',
+            statuses_count=i,
+            last_updated=now,
+        ) for i in range(count)
+    ]
+
+
+def make_session(path, base):
+    '''
+    A fresh database with the schema created.
+    '''
+    engine = create_engine(f'sqlite:///{path}')
+    base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def merge_each_commit(session, model, rows):
+    '''
+    The old timeline path: merge and commit every row.
+    '''
+    for row in rows:
+        session.merge(row)
+        session.commit()
+
+
+def merge_then_commit(session, model, rows):
+    '''
+    The old favorites path: merge every row, commit once.
+    '''
+    for row in rows:
+        session.merge(row)
+    session.commit()
+
+
+def upsert_then_commit(session, model, rows):
+    '''
+    The bulk path.
+    '''
+    bulk_upsert(session, model, rows)
+    session.commit()
+
+
+def run(label, base, model, factory, count):
+    '''
+    Time each strategy on a fresh database, for inserts and then updates.
+    '''
+    print(f'{label}: {count} rows')
+    for strategy in (merge_each_commit, merge_then_commit, upsert_then_commit):
+        with tempfile.TemporaryDirectory() as directory:
+            session = make_session(Path(directory, 'bench.db'), base)
+            for phase in ('insert', 'update'):
+                rows = factory(count)
+                start = time.perf_counter()
+                strategy(session, model, rows)
+                elapsed = time.perf_counter() - start
+                print(
+                    f'  {strategy.__name__:<20} {phase:<7} '
+                    f'{count / elapsed:>12,.0f} rows/s'
+                )
+            session.close()
+
+
+if __name__ == '__main__':
+    ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    run('timeline', USER_BASE, TimelineSQL, make_tweets, ROWS)
+    run('cache', DIR_BASE, CacheSQL, make_cache_users, ROWS)
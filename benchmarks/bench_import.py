@@ -0,0 +1,80 @@
+'''
+Time a cold import of each baquet module, in a fresh interpreter per run.
+Runs in an empty directory, so an import that needs config.json fails loudly
+and one that creates databases leaves them behind.
+
+Run from the repository root:
+    python -m benchmarks.bench_import [runs]
+'''
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+MODULES = (
+    'baquet.helpers',
+    'baquet.directory',
+    'baquet.watchlist',
+    'baquet.user',
+    'baquet.scoring',
+)
+
+# Report the import alone, not interpreter start up.
+_SCRIPT = '''
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+'''
+
+
+def time_import(module, directory):
+    '''
+    Seconds to import the module in a new interpreter,
+    or the last line of the error if the import fails.
+    '''
+    environment = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, (os.getcwd(), os.environ.get('PYTHONPATH'))))
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', _SCRIPT.format(module=module)],
+        cwd=directory,
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=False
+    )
+    if result.returncode:
+        return result.stderr.strip().splitlines()[-1]
+    return float(result.stdout.strip())
+
+
+def run(runs):
+    '''
+    Print the median and best import time of each module.
+    '''
+    print(f'cold imports: {runs} runs each')
+    for module in MODULES:
+        with tempfile.TemporaryDirectory() as directory:
+            timings = [time_import(module, directory) for _ in range(runs)]
+            created = sorted(str(path.relative_to(directory)) for path in Path(directory).rglob('*'))
+
+        failures = [timing for timing in timings if isinstance(timing, str)]
+        if failures:
+            print(f'  {module:<18} failed: {failures[0]}')
+            continue
+
+        print(
+            f'  {module:<18} median {statistics.median(timings) * 1000:>8.1f} ms'
+            f'  best {min(timings) * 1000:>8.1f} ms'
+            f'  created {created or "nothing"}'
+        )
+
+
+if __name__ == '__main__':
+    RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    run(RUNS)
@@ -0,0 +1,118 @@
+'''
+Compare ingest and read throughput of a user database under each storage profile.
+Ingest commits small batches, like a refresh. Reads page through the timeline.
+The mixed run reads from a second thread while the ingest runs.
+
+Run from the repository root:
+    python -m benchmarks.bench_storage_profiles [rows]
+'''
+
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from baquet.constants import BaquetConstants
+from baquet.engines import EngineRegistry, STORAGE_PROFILES
+from baquet.helpers import bulk_upsert
+from baquet.migrations import migrate
+from baquet.sql.user import TimelineSQL
+from benchmarks.bench_bulk_upsert import make_tweets
+
+BATCH_SIZE = 100
+PAGE_SIZE = 100
+# None is SQLite's own defaults, the behaviour before storage profiles.
+PROFILES = (None, *STORAGE_PROFILES)
+
+
+def open_database(directory, profile):
+    '''
+    A migrated user database under the profile.
+    '''
+    registry = EngineRegistry(profile=profile)
+    _, session = registry.get(
+        Path(directory, 'bench.db'),
+        setup=lambda engine: migrate(engine, BaquetConstants.USER)
+    )
+    return registry, session
+
+
+def ingest(session, rows):
+    '''
+    Upsert the rows a batch at a time, committing each batch.
+    '''
+    for start in range(0, len(rows), BATCH_SIZE):
+        bulk_upsert(session, TimelineSQL, rows[start:start + BATCH_SIZE])
+        session.commit()
+    session.remove()
+
+
+def read(session, pages, stop=None):
+    '''
+    Read pages of the timeline, newest first. Returns (pages read, lock errors).
+    '''
+    done = errors = 0
+    query = text(
+        'SELECT * FROM timeline ORDER BY created_at DESC LIMIT :limit OFFSET :offset'
+    )
+    while done < pages and not (stop and stop.is_set()):
+        try:
+            session.execute(query, {'limit': PAGE_SIZE, 'offset': done % 50 * PAGE_SIZE}).all()
+            done += 1
+        except OperationalError:
+            errors += 1
+        session.rollback()
+    session.remove()
+    return done, errors
+
+
+def run(count):
+    '''
+    Time each profile on a fresh database.
+    '''
+    print(f'storage profiles: {count} rows, batches of {BATCH_SIZE}, pages of {PAGE_SIZE}')
+    for profile in PROFILES:
+        with tempfile.TemporaryDirectory() as directory:
+            registry, session = open_database(directory, profile)
+
+            start = time.perf_counter()
+            ingest(session, make_tweets(count))
+            ingest_rate = count / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            pages, _ = read(session, 2000)
+            read_rate = pages / (time.perf_counter() - start)
+
+            # Upserting the same rows again keeps the database the same size.
+            stop = threading.Event()
+            result = {}
+            reader = threading.Thread(
+                target=lambda: result.update(mixed=read(session, sys.maxsize, stop))
+            )
+            start = time.perf_counter()
+            reader.start()
+            ingest(session, make_tweets(count))
+            stop.set()
+            reader.join()
+            elapsed = time.perf_counter() - start
+            mixed_pages, mixed_errors = result['mixed']
+
+            registry.clear()
+
+        print(
+            f'  {profile or "sqlite default":<15}'
+            f' ingest {ingest_rate:>10,.0f} rows/s'
+            f'  read {read_rate:>8,.0f} pages/s'
+            f'  mixed {count / elapsed:>10,.0f} rows/s'
+            f' {mixed_pages / elapsed:>8,.0f} pages/s'
+            f' {mixed_errors:>4} lock errors'
+        )
+
+
+if __name__ == '__main__':
+    ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    run(ROWS)